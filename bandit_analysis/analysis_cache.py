@@ -0,0 +1,155 @@
+import ast
+import hashlib
+import io
+import json
+import os
+import threading
+import tokenize
+
+class AnalysisCache():
+    """
+    A persistent, content-addressed cache of analysis results.
+
+    Entries are keyed by a hash of the AST-normalized code, so code that
+    differs only in trailing whitespace or comments at the end of a line
+    maps to the same entry. The AST's line and column positions are part
+    of the key, so the line numbers in a cached result always match the
+    code it is returned for. Each entry is stored as a JSON file in the
+    cache directory, and the least recently used entries are evicted once
+    the cache grows past max_entries.
+
+    Attributes:
+      cache_dir: The directory holding the cache entries.
+      max_entries: The maximum number of entries kept on disk.
+      signature: Identifies the analyzer version and configuration.
+        Results from a different signature are never reused.
+    """
+    def __init__(self, cache_dir, signature, max_entries=1024):
+        """
+        Initializes the cache, creating the cache directory if needed.
+
+        Args:
+          cache_dir: The directory holding the cache entries.
+          signature: Identifies the analyzer version and configuration.
+          max_entries: The maximum number of entries kept on disk (optional).
+        """
+        self.cache_dir = cache_dir
+        self.signature = signature
+        self.max_entries = max_entries
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, code):
+        """
+        Computes the cache key of the given code.
+
+        Args:
+          code: The Python source code.
+        Returns:
+          The hex digest identifying the code and analyzer signature.
+        """
+        return hashlib.sha256((self.signature + "\0" + normalize_code(code)).encode("utf-8")).hexdigest()
+
+    def get(self, code):
+        """
+        Looks up the cached result for the given code.
+
+        Args:
+          code: The Python source code.
+        Returns:
+          The cached result or None if there is no entry for the code.
+        """
+        entry_path = self._entry_path(self.key(code))
+        try:
+            with open(entry_path) as entry_file:
+                result = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+        # Mark the entry as recently used.
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        return result
+
+    def put(self, code, result):
+        """
+        Stores the result for the given code and evicts the least
+        recently used entries if the cache is full.
+
+        Args:
+          code: The Python source code.
+          result: A JSON serializable analysis result.
+        """
+        entry_path = self._entry_path(self.key(code))
+
+        # Write to a temporary file first so readers never see a partial entry.
+        # The name is unique per thread, as threads may store the same code at once.
+        temp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as entry_file:
+            json.dump(result, entry_file)
+        os.replace(temp_path, entry_path)
+
+        self._evict()
+
+    def _entry_path(self, key):
+        """
+        Returns the path of the file holding the entry with the given key.
+        """
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _evict(self):
+        """
+        Removes the least recently used entries until the cache holds
+        at most max_entries entries.
+        """
+        entries = []
+        with os.scandir(self.cache_dir) as scan:
+            for entry in scan:
+                if entry.name.endswith(".json"):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except OSError:
+                        pass
+
+        if len(entries) <= self.max_entries:
+            return
+
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def normalize_code(code):
+    """
+    Normalizes code so that formatting-only differences are ignored.
+
+    The code is reduced to a dump of its AST, including the positions of
+    its nodes, since findings refer to them. Comments are dropped, except
+    for "nosec" comments, which change what Bandit reports. Code that
+    cannot be parsed is normalized by stripping whitespace from every
+    line instead, keeping blank lines so the line numbers stay the same.
+
+    Args:
+      code: The Python source code.
+    Returns:
+      The normalized code as a string.
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return "\n".join(line.strip() for line in code.splitlines())
+
+    nosec_comments = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type == tokenize.COMMENT and "nosec" in token.string:
+                nosec_comments.append(f"{token.start[0]}:{token.string}")
+    except (tokenize.TokenError, SyntaxError):
+        pass
+
+    return ast.dump(tree, include_attributes=True) + "\n" + "\n".join(nosec_comments)
@@ -0,0 +1,449 @@
+import ast
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from bandit_analysis.preflight import find_syntax_error
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+# Functions of the re module that take a pattern as their first argument.
+REGEX_FUNCTIONS = {"compile", "search", "match", "fullmatch", "split", "findall", "finditer", "sub", "subn"}
+
+# The characters used to decide whether two character classes overlap.
+PROBE_CHARACTERS = [chr(code) for code in range(128)]
+
+class BanditAnalyzer():
+    """
+    Runs Bandit on the code through an in-process BanditEngine.
+
+    Bandit's findings drive repair, so it is required: a scan that does
+    not finish in time is waited for without a deadline, and a scan that
+    fails is run again.
+
+    Attributes:
+      name: The name of the analyzer.
+      timeout: The number of seconds the analyzer is expected to run. As
+        it is required, a slower scan is still waited for.
+      required: Indicates if the analyzer is waited for without a deadline
+        and run again if it fails, instead of being skipped.
+      engine: The BanditEngine used to scan the code.
+    """
+    name = "bandit"
+    required = True
+
+    def __init__(self, engine, timeout=30):
+        """
+        Initializes the analyzer.
+
+        Args:
+          engine: The BanditEngine used to scan the code.
+          timeout: The number of seconds the analyzer may run (optional).
+        """
+        self.engine = engine
+        self.timeout = timeout
+
+    def analyze(self, code):
+        """
+        Scans the code with Bandit.
+
+        Args:
+          code: The Python source code to analyze.
+        Returns:
+          A list of findings in the same format as BanditEngine.scan.
+        """
+        return self.engine.scan(code)
+
+class SyntaxAnalyzer():
+    """
+    Checks that the code compiles. Bandit skips files it cannot parse,
+    so without this check broken code looks free of issues. Pipelines
+    that only analyze code after compiling it do not need it.
+
+    Attributes:
+      name: The name of the analyzer.
+      timeout: The number of seconds the analyzer may run.
+      required: Indicates if the analyzer is waited for without a deadline
+        and run again if it fails, instead of being skipped.
+    """
+    name = "syntax"
+    required = False
+
+    def __init__(self, timeout=5):
+        """
+        Initializes the analyzer.
+
+        Args:
+          timeout: The number of seconds the analyzer may run (optional).
+        """
+        self.timeout = timeout
+
+    def analyze(self, code):
+        """
+        Compiles the code without running it.
+
+        Args:
+          code: The Python source code to analyze.
+        Returns:
+          A list holding one finding if the code does not compile, otherwise
+            an empty list.
+        """
+        error = find_syntax_error(code)
+        if error is None:
+            return []
+
+        line_number, message = error
+        return [make_finding("SCG001", "syntax_error", "HIGH", "HIGH",
+                             f"The code does not compile: {message}", line_number)]
+
+class RedosAnalyzer():
+    """
+    Looks for regular expressions that can take exponential or polynomial
+    time on crafted input (ReDoS). Patterns passed to the re module as
+    string literals, or through variables assigned string literals, are
+    checked for nested unbounded quantifiers, such as (a+)+, and for
+    unbounded quantifiers that can match the same text one after another,
+    such as \\d+\\d+ or [\\w.]+\\.\\w+.
+
+    Attributes:
+      name: The name of the analyzer.
+      timeout: The number of seconds the analyzer may run.
+      required: Indicates if the analyzer is waited for without a deadline
+        and run again if it fails, instead of being skipped.
+    """
+    name = "redos"
+    required = False
+
+    def __init__(self, timeout=5):
+        """
+        Initializes the analyzer.
+
+        Args:
+          timeout: The number of seconds the analyzer may run (optional).
+        """
+        self.timeout = timeout
+
+    def analyze(self, code):
+        """
+        Checks the regular expressions used by the code.
+
+        Args:
+          code: The Python source code to analyze.
+        Returns:
+          A list of findings, one per vulnerable pattern use.
+        """
+        try:
+            tree = ast.parse(code)
+        except (SyntaxError, ValueError):
+            return []
+
+        # Remember string constants assigned to names, so patterns stored
+        # in variables are checked where they are used.
+        constants = {}
+        for node in ast.walk(tree):
+            if (isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)
+                    and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)):
+                constants[node.targets[0].id] = node.value.value
+
+        findings = []
+        for node in ast.walk(tree):
+            if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                    and isinstance(node.func.value, ast.Name) and node.func.value.id == "re"
+                    and node.func.attr in REGEX_FUNCTIONS and node.args):
+                continue
+
+            pattern = node.args[0]
+            if isinstance(pattern, ast.Constant) and isinstance(pattern.value, str):
+                pattern = pattern.value
+            elif isinstance(pattern, ast.Name) and pattern.id in constants:
+                pattern = constants[pattern.id]
+            else:
+                continue
+
+            problem = find_redos(pattern)
+            if problem:
+                severity, description = problem
+                findings.append(make_finding("SCG002", "regex_denial_of_service", severity, "MEDIUM",
+                                             f"Regular expression {pattern!r} {description}",
+                                             node.lineno, node.col_offset, node.end_col_offset,
+                                             list(range(node.lineno, (node.end_lineno or node.lineno) + 1))))
+        return findings
+
+class AnalyzerPipeline():
+    """
+    Runs several analyzers on the same code in parallel and merges their
+    findings. Each analyzer has its own timeout, so the whole analysis
+    takes about as long as the slowest analyzer instead of the sum of all
+    of them.
+
+    Analyzers run on a shared thread pool, and each deadline counts from
+    when the analyzer starts, not from when it was queued. An optional
+    analyzer that times out or fails is left to finish in the background
+    and its findings are missing from the run, which is then incomplete.
+    A required analyzer is waited for past its deadline, and if it
+    fails, it is run again in the calling thread. If that fails too, the
+    error is raised.
+
+    Attributes:
+      analyzers: The analyzers to run. Each has a name, a timeout, a
+        required flag and an analyze function that takes code and
+        returns a list of findings.
+      executor: The thread pool the analyzers run on.
+    """
+    def __init__(self, analyzers, max_workers=None):
+        """
+        Initializes the pipeline.
+
+        Args:
+          analyzers: The analyzers to run.
+          max_workers: The size of the thread pool. Defaults to enough
+            threads to run two analyses at once (optional).
+        """
+        self.analyzers = analyzers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or 2 * len(analyzers),
+                                           thread_name_prefix="analyzer")
+
+    @property
+    def signature(self):
+        """
+        The names of the analyzers, used to tell cached results apart.
+        """
+        return ",".join(analyzer.name for analyzer in self.analyzers)
+
+    def run(self, code):
+        """
+        Runs every analyzer on the code.
+
+        Args:
+          code: The Python source code to analyze.
+        Returns:
+          A tuple of the merged findings, a dictionary with the number of
+            seconds each analyzer took (None if it timed out or failed), and
+            whether every analyzer finished.
+        Raises:
+          Exception: The error of a required analyzer that failed twice.
+        """
+        start_times = {}
+
+        def timed(analyzer):
+            start_times[analyzer.name] = time.perf_counter()
+            findings = analyzer.analyze(code)
+            return findings, time.perf_counter() - start_times[analyzer.name]
+
+        futures = {analyzer: self.executor.submit(timed, analyzer) for analyzer in self.analyzers}
+
+        findings = []
+        timings = {}
+        complete = True
+        for analyzer, future in futures.items():
+            # The deadline counts from when the analyzer starts, so time spent
+            # waiting for a pool thread does not count against it.
+            while True:
+                start_time = start_times.get(analyzer.name)
+                remaining = analyzer.timeout if start_time is None else analyzer.timeout - (time.perf_counter() - start_time)
+                done, _ = wait([future], timeout=max(remaining, 0))
+                if done or (start_time is not None and remaining <= 0):
+                    break
+
+            if not done and analyzer.required:
+                # Required findings are never skipped, so wait for the
+                # analyzer to finish instead of starting it over.
+                wait([future])
+                done = True
+
+            if done and future.exception() is None:
+                analyzer_findings, timings[analyzer.name] = future.result()
+                findings.extend(analyzer_findings)
+            elif analyzer.required:
+                # The analyzer failed, so run it once more here.
+                analyzer_findings, timings[analyzer.name] = timed(analyzer)
+                findings.extend(analyzer_findings)
+            else:
+                future.cancel()
+                timings[analyzer.name] = None
+                complete = False
+
+        return findings, timings, complete
+
+def make_finding(test_id, test_name, severity, confidence, text, line_number,
+                 col_offset=0, end_col_offset=0, line_range=None):
+    """
+    Builds a finding in the same format as BanditEngine.scan.
+
+    Args:
+      test_id: The ID of the check that found the issue.
+      test_name: The name of the check that found the issue.
+      severity: The severity of the issue (LOW, MEDIUM or HIGH).
+      confidence: The confidence of the check (LOW, MEDIUM or HIGH).
+      text: A description of the issue.
+      line_number: The line the issue was found on.
+      col_offset: The column the issue starts at (optional).
+      end_col_offset: The column the issue ends at (optional).
+      line_range: The lines covered by the issue (optional).
+    Returns:
+      The finding as a dictionary.
+    """
+    return {
+        "filename": "./generated.py",
+        "test_name": test_name,
+        "test_id": test_id,
+        "issue_severity": severity,
+        "issue_confidence": confidence,
+        "issue_cwe": "",
+        "issue_text": text,
+        "line_number": line_number,
+        "col_offset": col_offset,
+        "end_col_offset": end_col_offset,
+        "line_range": line_range or [line_number],
+        "more_info": "",
+    }
+
+def find_redos(pattern):
+    """
+    Checks a regular expression for catastrophic backtracking.
+
+    Args:
+      pattern: The regular expression.
+    Returns:
+      A tuple of the severity and a description of the problem, or None
+        if no problem was found.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return None
+
+    if has_nested_repeat(parsed, inside_repeat=False):
+        return "HIGH", "nests unbounded quantifiers and can take exponential time to match."
+    if has_overlapping_repeats(parsed):
+        return "MEDIUM", "has unbounded quantifiers that can match the same text and can take polynomial time to match."
+    return None
+
+def repeat_body(item):
+    """
+    Returns the body of an unbounded repeat, or None if the item is not one.
+    """
+    op, value = item
+    if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and value[1] == sre_parse.MAXREPEAT:
+        return value[2]
+    return None
+
+def child_patterns(item):
+    """
+    Returns the sub-patterns directly inside a parsed item.
+    """
+    op, value = item
+    if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+        return [value[2]]
+    if op == sre_parse.SUBPATTERN:
+        return [value[-1]]
+    if op == sre_parse.BRANCH:
+        return value[1]
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return [value[1]]
+    return []
+
+def has_nested_repeat(parsed, inside_repeat):
+    """
+    Checks whether an unbounded repeat contains another unbounded repeat.
+    """
+    for item in parsed:
+        body = repeat_body(item)
+        if body is not None:
+            if inside_repeat or has_nested_repeat(body, inside_repeat=True):
+                return True
+            continue
+        for child in child_patterns(item):
+            if has_nested_repeat(child, inside_repeat):
+                return True
+    return False
+
+def has_overlapping_repeats(parsed):
+    """
+    Checks whether an unbounded repeat of a character class is followed,
+    possibly after characters it can also match, by another unbounded
+    repeat that matches some of the same characters.
+    """
+    items = list(parsed)
+    for index, item in enumerate(items):
+        for child in child_patterns(item):
+            if has_overlapping_repeats(child):
+                return True
+
+        body = repeat_body(item)
+        first = character_set(body) if body is not None else None
+        if not first:
+            continue
+
+        for following in items[index + 1:]:
+            following_body = repeat_body(following)
+            if following_body is not None:
+                second = character_set(following_body)
+                if second and first & second:
+                    return True
+                break
+
+            # Single characters the first repeat can also match let the two
+            # repeats trade text between them.
+            single = character_set([following])
+            if not single or not single <= first:
+                break
+    return False
+
+def character_set(parsed):
+    """
+    Returns the ASCII characters matched by a pattern made of a single
+    character, character class or wildcard, or None for other patterns.
+    """
+    items = list(parsed)
+    if len(items) != 1:
+        return None
+
+    op, value = items[0]
+    if op == sre_parse.LITERAL:
+        return {chr(value)} if value < 128 else set()
+    if op == sre_parse.NOT_LITERAL:
+        return {char for char in PROBE_CHARACTERS if ord(char) != value}
+    if op == sre_parse.ANY:
+        return {char for char in PROBE_CHARACTERS if char != "\n"}
+    if op == sre_parse.IN:
+        return {char for char in PROBE_CHARACTERS if class_matches(value, char)}
+    return None
+
+def class_matches(class_items, char):
+    """
+    Checks whether a parsed character class matches a character.
+    """
+    code = ord(char)
+    matched = False
+    negate = False
+    for op, value in class_items:
+        if op == sre_parse.NEGATE:
+            negate = True
+        elif op == sre_parse.LITERAL and value == code:
+            matched = True
+        elif op == sre_parse.RANGE and value[0] <= code <= value[1]:
+            matched = True
+        elif op == sre_parse.CATEGORY and category_matches(value, char):
+            matched = True
+    return matched != negate
+
+def category_matches(category, char):
+    """
+    Checks whether a character belongs to a character class category such as \\d.
+    """
+    name = str(category)
+    if name.endswith("NOT_DIGIT"):
+        return not char.isdigit()
+    if name.endswith("DIGIT"):
+        return char.isdigit()
+    if name.endswith("NOT_SPACE"):
+        return not char.isspace()
+    if name.endswith("SPACE"):
+        return char.isspace()
+    if name.endswith("NOT_WORD"):
+        return not (char.isalnum() or char == "_")
+    if name.endswith("WORD"):
+        return char.isalnum() or char == "_"
+    return False
@@ -0,0 +1,104 @@
+import csv
+import hashlib
+import io
+import threading
+
+import bandit
+from bandit.core import config as b_config
+from bandit.core import docs_utils
+from bandit.core import manager as b_manager
+from bandit.core import meta_ast as b_meta_ast
+from bandit.core import metrics as b_metrics
+
+# The columns written by "bandit -f csv", in the same order.
+BANDIT_REPORT_FIELDS = [
+    "filename",
+    "test_name",
+    "test_id",
+    "issue_severity",
+    "issue_confidence",
+    "issue_cwe",
+    "issue_text",
+    "line_number",
+    "col_offset",
+    "end_col_offset",
+    "line_range",
+    "more_info",
+]
+
+class BanditEngine():
+    """
+    Runs Bandit inside the current process. The Bandit configuration
+    and plugin set are loaded once when the engine is created and reused
+    for every scan, and code is scanned straight from a string.
+
+    Attributes:
+      manager: The Bandit manager holding the loaded plugin set.
+      signature: Identifies the Bandit version and configuration, so
+        results can be cached across runs.
+    """
+    def __init__(self, config_file=None):
+        """
+        Loads the Bandit configuration and plugins.
+
+        Args:
+          config_file: A Bandit configuration file to use (optional).
+        """
+        self.config_file = config_file
+        self.manager = b_manager.BanditManager(b_config.BanditConfig(config_file), "file", quiet=True)
+
+        config_hash = "default"
+        if config_file:
+            with open(config_file, "rb") as config:
+                config_hash = hashlib.sha256(config.read()).hexdigest()
+        self.signature = f"bandit-{bandit.__version__}:{config_hash}"
+
+        # The manager keeps per-scan state, so only one scan may use it at a time.
+        self._lock = threading.Lock()
+
+    def scan(self, code, file_name="./generated.py"):
+        """
+        Scans the given code with Bandit without writing it to disk.
+
+        Args:
+          code: The Python source code to scan.
+          file_name: The name reported for the code in each finding (optional).
+        Returns:
+          A list of findings, one dictionary per issue, with the same
+            fields as a Bandit CSV report.
+        """
+        with self._lock:
+            self._reset()
+            self.manager._parse_file(file_name, io.BytesIO(code.encode("utf-8")), [file_name])
+            issues = self.manager.get_issue_list()
+
+        findings = []
+        for issue in issues:
+            finding = issue.as_dict(with_code=False)
+            finding["issue_cwe"] = finding["issue_cwe"].get("link", "")
+            finding["more_info"] = docs_utils.get_url(finding["test_id"])
+            findings.append(finding)
+        return findings
+
+    def _reset(self):
+        """
+        Clears the results of the previous scan from the manager.
+        """
+        self.manager.b_ma = b_meta_ast.BanditMetaAst()
+        self.manager.metrics = b_metrics.Metrics()
+        self.manager.results = []
+        self.manager.scores = []
+        self.manager.skipped = []
+
+def write_bandit_report(findings, report_filename):
+    """
+    Writes findings to a file in the same CSV format as "bandit -f csv".
+
+    Args:
+      findings: The findings returned by BanditEngine.scan.
+      report_filename: The name of the target output file.
+    """
+    with open(report_filename, "w", newline="") as report_file:
+        writer = csv.DictWriter(report_file, fieldnames=BANDIT_REPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(findings)
@@ -0,0 +1,59 @@
+import ast
+import functools
+import importlib.util
+import sys
+
+def find_syntax_error(code):
+    """
+    Compiles the code in memory without running it.
+
+    Args:
+      code: The Python source code to check.
+    Returns:
+      A tuple of the line number and message of the first syntax error,
+        or None if the code compiles.
+    """
+    try:
+        compile(code, "<generated>", "exec", dont_inherit=True)
+    except SyntaxError as error:
+        return error.lineno or 1, error.msg
+    except ValueError as error:
+        # Raised for source code containing null bytes.
+        return 1, str(error)
+    return None
+
+def find_missing_imports(code):
+    """
+    Finds the top-level modules imported by the code that are neither in
+    the standard library nor installed.
+
+    Args:
+      code: The Python source code to check. It must compile.
+    Returns:
+      A sorted list of the missing module names.
+    """
+    modules = set()
+    for node in ast.walk(ast.parse(code)):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            modules.add(node.module.split(".")[0])
+
+    return sorted(module for module in modules if not is_installed(module))
+
+@functools.lru_cache(maxsize=None)
+def is_installed(module):
+    """
+    Checks whether a top-level module can be imported, without importing it.
+
+    Args:
+      module: The name of the module.
+    Returns:
+      True if the module is in the standard library or installed.
+    """
+    if module in getattr(sys, "stdlib_module_names", ()) or module in sys.builtin_module_names:
+        return True
+    try:
+        return importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
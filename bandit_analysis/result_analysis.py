@@ -1,94 +1,212 @@
-# importing pandas module
-import pandas as pd
-
-# This is a Dictionary that has the Issue codes as keys and the desired prompt to be used as the values
-CODE_DICT = {
-    "B101": "Consider raising a semantically meaningful error or AssertionError instead of an assert",
-    "B102": "Do not use the exec method or keyword",
-    "B103": "Use secure file permissions",
-    "B104": "Do not use any hardcoded bindings to all network interfaces",
-    "B105": "Do not hardcode any passwords",
-    "B106": "Do not use hard-coded password function arguments",
-    "B107": "Do not use any hard-coded password argument defaults",
-    "B108": "Do not use a temporary file or directory insecurely",
-    "B109": "Ensure that password based config option is marked secret",
-    "B110": "Do not use the pass keyword in an exception block",
-    "B112": "Do not use the continue keyword in an exception block",
-    "B113": "Do not use requests or httpx calls without a specified timeout",
-    "B201": "Do not run a flask app with debug set to true",
-    "B202": "Only use Use tarfile.extractall(members=function_name) and define a function that will inspect each member. Discard files that contain a directory traversal sequences such as ../ or \\.. along with all special filetypes unless you explicitly need them.",
-    "B324": "Do not use MD4, MD5, or SHA1 hash functions as these are insecure",
-    "B501": "Ensure that certificate validation is turned on",
-    "B502": "Avoid using the following SSL and TLS versions: SSL v2, SSL v3, TLS v1, TLS v1.1",
-    "B503": "Avoid using the following versions of SSL and TLS versions as default parameters: SSL v2, SSL v3, TLS v1, TLS v1.1",
-    "B504": "Make sure to specify a SSL/TLS version that is not one of the following: SSL v2, SSL v3, TLS v1, TLS v1.1",
-    "B505": "Make sure to use RSA and DSA key lengths of at least size 2048 or EC key length sizes of at least 224",
-    "B506": "Please use yaml.safe_load instead of yaml.load",
-    "B507": "Ensure that host key verification is enabled",
-    "B508": "The use of SNMPv1 and SNMPv2 is insecure. You should use SNMPv3 if able.",
-    "B509": "You should not use SNMPv3 without encryption. noAuthNoPriv & authNoPriv is insecure",
-    "B601": "Possible shell injection via Paramiko call, Ensure that inputs are properly sanitized.",
-    "B602": "Subprocess call with shell=True seems safe, Try rewriting without shell",
-    "B603": "Subprocess call - ensure that there is no execution of untrusted input.",
-    "B604": "Function call with shell=True parameter identified, Try to refrain from do this.",
-    "B605": "Starting a process with a shell: Ensure that no injection can take place",
-    "B606": "Ensure that process is started securely despite running without a shell",
-    "B607": "Starting a process with a partial executable path. Try to refrain from doing so",
-    "B608": "Try to protect against SQL injection by avoiding hardcoded SQL expressions",
-    "B609": "Previous code had possible wildcard injection. Try to avoid using the wildcard character in place of a file system path",
-    "B610": "Try to protect against extra potential SQL injection attack vector in django",
-    "B611": "Try to protect against RawSQL potential SQL injection attack vector in django",
-    "B612": "Ensure that the logging.config.listen function is used securely",
-    "B613": "Avoid using unicode bidirectional control characters",
-    "B614": "Use torch.load with the safetesnors library from hugingface",
-    "B701": "Use autoescape=True to mitigate XSS vulnerabilities.",
-    "B702": "Ensure variables in all templates are properly sanitized via the 'n', 'h' or 'x' flags (depending on context)",
-    "B703": "Protect against XSS on mark_safe functions",
-}
-
-def find_issue_code(report_filename):
-    """
-    This function goes through the .csv created by Bandit and
+import csv
+import json
+import os
+
+# Bandit's severity and confidence levels, from lowest to highest.
+RANKING = ["UNDEFINED", "LOW", "MEDIUM", "HIGH"]
+
+# The default remediation registry, covering Bandit's plugins and blacklists.
+REMEDIATIONS_FILE_NAME = os.path.join(os.path.dirname(os.path.realpath(__file__)), "remediations.json")
+
+def load_remediations(file_name):
+    """
+    This function loads a remediation registry from a JSON file that maps
+    Bandit issue codes to the prompts we want to use for them.
+
+    Args:
+      file_name: The filename of the registry.
+    Returns:
+      A dictionary with the issue codes as keys and the prompts as values.
+    """
+    with open(file_name) as registry_file:
+        return json.load(registry_file)
+
+def register_remediations(remediations):
+    """
+    This function adds prompts to the registry or replaces existing ones,
+    for example for the codes of Bandit plugins installed by the user.
+
+    Args:
+      remediations: A dictionary with issue codes as keys and prompts as values,
+        or the filename of a JSON registry.
+    """
+    if isinstance(remediations, str):
+        remediations = load_remediations(remediations)
+    CODE_DICT.update(remediations)
+
+# This is a Dictionary that has the Issue codes as keys and the desired prompt to be used as the values.
+# It is loaded once, when this module is imported.
+CODE_DICT = load_remediations(REMEDIATIONS_FILE_NAME)
+
+def read_findings(report_filename):
+    """
+    This function reads the findings in a report generated by Bandit
+    one at a time. Both the CSV and JSON report formats are supported.
+
+    Args:
+      report_filename: The filename of the .csv or .json generated by Bandit.
+    Yields:
+      Each finding in the report as a dictionary.
+    """
+    with open(report_filename, newline="") as report_file:
+        if report_filename.endswith(".json"):
+            yield from json.load(report_file).get("results", [])
+        else:
+            yield from csv.DictReader(report_file)
+
+def find_issue_code(bandit_results):
+    """
+    This function goes through the results of a Bandit scan and
     finds all the unique issue codes found.
 
     Args:
-      report_filename: The filename of the .csv generated by Bandit.
+      bandit_results: The filename of the .csv or .json generated by
+        Bandit, or the list of findings returned by BanditEngine.scan.
     Returns:
-      A list of all unique issue codes that were generated by Bandit.
+      A list of all unique issue codes that were generated by Bandit,
+        in the order they were first found.
     """
-    df = pd.read_csv(report_filename)
-    all_codes = df.test_id
-    unique_codes = list(set(all_codes))
+    if isinstance(bandit_results, str):
+        bandit_results = read_findings(bandit_results)
+
+    # dict.fromkeys keeps the first-seen order, so the same findings always
+    # produce the same issue list and the same regeneration prompt.
+    unique_codes = list(dict.fromkeys(finding["test_id"] for finding in bandit_results))
     return unique_codes
 
-def codes_to_issues(unique_codes):
+def codes_to_issues(unique_codes, issue_texts=None):
     """
     This function takes all the unique issue codes generated by Bandit
     and turns them into the prompts we want to use when constructing
-    our 2nd secure prompt.
+    our 2nd secure prompt. Codes missing from the registry fall back to
+    Bandit's own issue text, so unknown codes never stop a run.
 
     Args:
       unique_codes: A list of all unique codes that were generated by Bandit.
+      issue_texts: A dictionary with issue codes as keys and Bandit's issue
+        text as values, used for codes missing from the registry (optional).
     Returns:
       A list of all the prompts we want to add to the prompt given back
         to ChatGPT based on the codes we added.
     """
+    issue_texts = issue_texts or {}
     issue_prompts = []
     for code in unique_codes:
-        issue_prompts.append(CODE_DICT[code])
+        if code in CODE_DICT:
+            issue_prompts.append(CODE_DICT[code])
+        elif issue_texts.get(code):
+            issue_prompts.append(f"Fix this issue: {issue_texts[code]}")
+        else:
+            issue_prompts.append(f"Fix the security issue reported by Bandit check {code}")
     return issue_prompts
 
-def result_analysis(bandit_file_path):
+def prioritize_findings(bandit_results):
+    """
+    This function groups the findings of a Bandit scan by issue code and
+    ranks the codes by risk. Each code takes the highest severity and
+    confidence of its findings. Codes are ordered by severity, then
+    confidence, then the number of findings.
+
+    Args:
+      bandit_results: The filename of the .csv or .json generated by
+        Bandit, or the list of findings returned by BanditEngine.scan.
+    Returns:
+      A list of issues, highest risk first. Each issue is a dictionary with
+        the test_id, the issue prompt, the severity and confidence, the
+        sorted line numbers it was found on, and the count of findings.
+    """
+    if isinstance(bandit_results, str):
+        bandit_results = read_findings(bandit_results)
+
+    issues = {}
+    for finding in bandit_results:
+        code = finding["test_id"]
+        issue = issues.get(code)
+        if issue is None:
+            issue = issues[code] = {
+                "test_id": code,
+                "issue": codes_to_issues([code], {code: finding.get("issue_text")})[0],
+                "severity": "UNDEFINED",
+                "confidence": "UNDEFINED",
+                "lines": [],
+                "count": 0,
+            }
+
+        issue["severity"] = max(issue["severity"], finding["issue_severity"], key=RANKING.index)
+        issue["confidence"] = max(issue["confidence"], finding["issue_confidence"], key=RANKING.index)
+        issue["lines"].extend(finding_lines(finding))
+        issue["count"] += 1
+
+    for issue in issues.values():
+        issue["lines"] = sorted(set(issue["lines"]))
+
+    return sorted(issues.values(), key=lambda issue: (-RANKING.index(issue["severity"]),
+                                                      -RANKING.index(issue["confidence"]),
+                                                      -issue["count"]))
+
+def finding_lines(finding):
+    """
+    This function returns the line numbers covered by a finding. Findings
+    read from a CSV report store their line range as text.
+
+    Args:
+      finding: A finding from a Bandit scan.
+    Returns:
+      A list of line numbers.
+    """
+    line_range = finding.get("line_range")
+    if isinstance(line_range, str):
+        line_range = json.loads(line_range) if line_range else []
+    if not line_range and finding.get("line_number"):
+        line_range = [finding["line_number"]]
+    return [int(line) for line in line_range]
+
+def filter_issues(issues, min_severity="LOW", min_confidence="LOW"):
+    """
+    This function keeps only the issues at or above the given thresholds.
+
+    Args:
+      issues: The issues returned by prioritize_findings.
+      min_severity: The lowest severity to keep (optional).
+      min_confidence: The lowest confidence to keep (optional).
+    Returns:
+      The issues that meet both thresholds, in their original order.
+    """
+    return [issue for issue in issues
+            if RANKING.index(issue["severity"]) >= RANKING.index(min_severity)
+            and RANKING.index(issue["confidence"]) >= RANKING.index(min_confidence)]
+
+def format_issues(issues):
+    """
+    This function turns issues into the prompts we want to use when
+    constructing the regeneration prompt, including where each issue was
+    found and how severe it is.
+
+    Args:
+      issues: The issues returned by prioritize_findings.
+    Returns:
+      A list of issue prompts, in the same order as the issues.
+    """
+    issue_prompts = []
+    for issue in issues:
+        lines = ", ".join(str(line) for line in issue["lines"])
+        line_label = "line" if len(issue["lines"]) == 1 else "lines"
+        issue_prompts.append(f"{issue['issue']} ({issue['severity']} severity, {line_label} {lines})")
+    return issue_prompts
+
+def result_analysis(bandit_results, min_severity="LOW", min_confidence="LOW"):
     """
     Analyzes the results of the bandit report by identifying
     codes in the report and converting them to issues as strings.
 
     Args:
-      bandit_file_path: The filename of the .csv generated by Bandit.
+      bandit_results: The filename of the .csv or .json generated by
+        Bandit, or the list of findings returned by BanditEngine.scan.
+      min_severity: The lowest severity to include (optional).
+      min_confidence: The lowest confidence to include (optional).
     Returns:
       A list of all the prompts we want to add to the prompt given back
-        to ChatGPT based on the codes we added.
+        to ChatGPT based on the codes we added, highest risk first.
     """
-    codes = find_issue_code(bandit_file_path)
-    issues = codes_to_issues(codes)
-    return issues
+    issues = filter_issues(prioritize_findings(bandit_results), min_severity, min_confidence)
+    return [issue["issue"] for issue in issues]
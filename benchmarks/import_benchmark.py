@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Each snippet is run in a fresh interpreter and prints its import time and peak RSS.
+MEASURE = """
+import resource, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+STATEMENTS = {
+    "python (baseline)": "pass",
+    "bandit_analysis.result_analysis": "import bandit_analysis.result_analysis",
+    "pandas (previous dependency)": "import pandas",
+}
+
+def measure(statement, repeats):
+    """
+    Measures the import time and peak RSS of a statement in fresh
+    interpreters.
+
+    Args:
+      statement: The statement to run.
+      repeats: The number of interpreters to start.
+    Returns:
+      A tuple of the best import time in seconds and the peak RSS in KB,
+        or None if the statement fails, for example because the module
+        is not installed.
+    """
+    times = []
+    peak_rss = 0
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-c", MEASURE.format(statement=statement)],
+                                cwd=REPO_DIR, capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        elapsed, rss = result.stdout.split()
+        times.append(float(elapsed))
+        peak_rss = max(peak_rss, int(rss))
+    return min(times), peak_rss
+
+def main(repeats=5):
+    """
+    Benchmarks the start-up cost of the result analysis module against
+    the pandas import it used to need.
+
+    Args:
+      repeats: The number of interpreters started per measurement (optional).
+    """
+    for name, statement in STATEMENTS.items():
+        result = measure(statement, repeats)
+        if result is None:
+            print(f"{name:35} not available")
+        else:
+            print(f"{name:35} {result[0] * 1000:8.1f} ms {result[1] / 1024:8.1f} MB peak RSS")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from bandit_analysis.analysis_cache import AnalysisCache
+from bandit_analysis.result_analysis import read_findings
+from llm.data_set_retrieval import load_data_set
+from llm.fake_model import FakeModel, ReplayBackend
+from llm.scheduler import CallScheduler
+from secure_code_gen import (DATA_SET_FILE_NAME, FINAL_BANDIT_REPORT_FILE_NAME, PASS_PY_FILE_NAME, SecureCodeGen,
+                             get_file_path)
+
+# The pipeline stages reported, in pipeline order.
+STAGES = ["upload", "candidates", "llm_pass_1", "parse", "analysis", "bandit", "llm_repair", "llm_report", "publish"]
+
+STUB_REPORT = "Security report:\nThis response was replayed by the benchmark and has not been reviewed."
+
+class StageTimes():
+    """
+    Collects the durations of pipeline stages from concurrent runs.
+
+    Attributes:
+      samples: A dictionary mapping each stage name to its durations in seconds.
+    """
+    def __init__(self):
+        """
+        Initializes an empty collection.
+        """
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        """
+        Records one duration of a stage. Used as SecureCodeGen.stage_recorder.
+
+        Args:
+          stage: The name of the stage.
+          seconds: The duration of the stage.
+        """
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+def security_eval_backend(entries, latency):
+    """
+    Builds a stub backend that answers each SecurityEval prompt with the
+    insecure code recorded for it. Repair and report requests contain the
+    code, so they get the same answer back.
+
+    Args:
+      entries: The SecurityEval entries.
+      latency: The number of seconds each response takes.
+    Returns:
+      The backend.
+    """
+    def respond(contents):
+        prompt = contents if isinstance(contents, str) else " ".join(part for part in contents if isinstance(part, str))
+
+        # Inlined examples hold other prompts too, so use the prompt that appears first.
+        best_position, best_entry = None, None
+        for entry in entries:
+            position = prompt.find(entry["Prompt"])
+            if position != -1 and (best_position is None or position < best_position):
+                best_position, best_entry = position, entry
+
+        code = best_entry["Insecure_code"] if best_entry else "print(\"Hello, world!\")"
+        return f"```python\n{code}\n```\n\n{STUB_REPORT}"
+
+    return FakeModel(respond, latency=latency)
+
+def summarize(values):
+    """
+    Summarizes durations with their mean and nearest-rank percentiles.
+
+    Args:
+      values: The durations in seconds.
+    Returns:
+      A dictionary with the count, mean, p50, p95, p99 and max in milliseconds.
+    """
+    if not values:
+        return {"count": 0}
+
+    ordered = sorted(values)
+
+    def percentile(fraction):
+        return ordered[max(0, math.ceil(len(ordered) * fraction) - 1)] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered) * 1000,
+        "p50": percentile(0.50),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+        "max": ordered[-1] * 1000,
+    }
+
+def run_level(make_backend, prompts, concurrency, work_dir):
+    """
+    Runs every prompt through SecureCodeGen.generate at one concurrency level.
+    Each level starts with an empty analysis cache.
+
+    Args:
+      make_backend: A function that returns a new backend.
+      prompts: A list of (prompt ID, prompt) tuples.
+      concurrency: The number of prompts run at once.
+      work_dir: The directory for the level's output and cache.
+    Returns:
+      A dictionary with the level's results.
+    """
+    # The stub has no quota, so nothing but the pipeline limits throughput.
+    scg = SecureCodeGen("", backend=make_backend(), scheduler=CallScheduler(requests_per_minute=None),
+                        use_response_cache=False)
+    scg.analysis_cache = AnalysisCache(os.path.join(work_dir, "analysis_cache"), scg.analysis_cache.signature)
+    stage_times = StageTimes()
+    scg.stage_recorder = stage_times.record
+
+    run_times = []
+    run_times_lock = threading.Lock()
+
+    def run(prompt_id, prompt):
+        start_time = time.perf_counter()
+        output_dir = scg.generate(prompt, os.path.join(work_dir, "output", prompt_id))
+        with run_times_lock:
+            run_times.append(time.perf_counter() - start_time)
+        return output_dir
+
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            output_dirs = list(executor.map(lambda entry: run(*entry), prompts))
+    wall_time = time.perf_counter() - start_time
+
+    # Counting the issues analyzes the code again, which is not part of the runs.
+    scg.stage_recorder = None
+    issues_before = issues_after = 0
+    for output_dir in output_dirs:
+        if output_dir is None:
+            continue
+        with open(os.path.join(output_dir, PASS_PY_FILE_NAME.format(number=1))) as pass_1_file:
+            issues_before += len(scg.analyze_code(pass_1_file.read())[0])
+        issues_after += sum(1 for _ in read_findings(os.path.join(output_dir, FINAL_BANDIT_REPORT_FILE_NAME)))
+
+    return {
+        "concurrency": concurrency,
+        "prompts": len(prompts),
+        "succeeded": sum(1 for output_dir in output_dirs if output_dir is not None),
+        "wall_time_s": wall_time,
+        "throughput_per_s": len(prompts) / wall_time,
+        "run_latency_ms": summarize(run_times),
+        "stage_latency_ms": {stage: summarize(stage_times.samples.get(stage, [])) for stage in STAGES},
+        "issues_before_repair": issues_before,
+        "issues_after_repair": issues_after,
+        # The peak of the whole benchmark process so far, so it only grows from level to level.
+        "process_peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def git_commit():
+    """
+    Returns the commit the benchmark runs on, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    """
+    Benchmarks the whole SeCoGen pipeline over the SecurityEval prompts
+    with an offline backend, and writes the results to a JSON file so
+    they can be compared across versions.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the SeCoGen pipeline offline.")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma separated concurrency levels")
+    parser.add_argument("--limit", type=int, help="the number of SecurityEval prompts to run (default: all)")
+    parser.add_argument("--latency", type=float, default=0.0, help="the seconds each stub response takes")
+    parser.add_argument("--replay", metavar="DIR",
+                        help="replay a recorded run, such as wrapper_Test, instead of the SecurityEval stub")
+    parser.add_argument("--output", default="benchmark_results.json", help="the JSON file for the results")
+    args = parser.parse_args()
+
+    entries = load_data_set(get_file_path(DATA_SET_FILE_NAME))[:args.limit]
+    prompts = [(entry["ID"].replace(".py", ""), entry["Prompt"]) for entry in entries]
+
+    if args.replay:
+        make_backend = lambda: ReplayBackend.from_test_run(args.replay, latency=args.latency)
+    else:
+        make_backend = lambda: security_eval_backend(entries, args.latency)
+
+    levels = []
+    for concurrency in [int(level) for level in args.concurrency.split(",")]:
+        with tempfile.TemporaryDirectory() as work_dir:
+            level = run_level(make_backend, prompts, concurrency, work_dir)
+        levels.append(level)
+
+        run_latency = level["run_latency_ms"]
+        print(f"concurrency {concurrency:3}: {level['throughput_per_s']:7.2f} prompts/s,"
+              f" run p50 {run_latency['p50']:8.1f} ms, p95 {run_latency['p95']:8.1f} ms,"
+              f" p99 {run_latency['p99']:8.1f} ms, issues {level['issues_before_repair']}"
+              f" -> {level['issues_after_repair']}, process peak RSS {level['process_peak_rss_mb']:.0f} MB")
+        for stage in STAGES:
+            stage_latency = level["stage_latency_ms"][stage]
+            if stage_latency["count"]:
+                print(f"    {stage:12} n={stage_latency['count']:4} p50 {stage_latency['p50']:8.2f} ms"
+                      f" p95 {stage_latency['p95']:8.2f} ms p99 {stage_latency['p99']:8.2f} ms")
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "backend": f"replay:{args.replay}" if args.replay else "securityeval-stub",
+        "latency_s": args.latency,
+        "levels": levels,
+    }
+    with open(args.output, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from llm.data_set_retrieval import DataSetIndex, format_examples, load_data_set
+from secure_code_gen import DATA_SET_FILE_NAME, get_file_path
+
+QUERIES = [
+    "Write a Flask endpoint that runs a shell command given by the user",
+    "Load a YAML configuration file and return its contents",
+    "Create a login function that checks a username and password against a SQLite database",
+    "Validate an email address with a regular expression",
+    "Extract an uploaded tar archive into a directory",
+]
+
+def main(repeats=1000):
+    """
+    Benchmarks building the SecurityEval index and querying it, and
+    compares the size of the inlined examples with the whole data set.
+
+    Args:
+      repeats: The number of times each measurement is repeated (optional).
+    """
+    data_set_path = get_file_path(DATA_SET_FILE_NAME)
+    entries = load_data_set(data_set_path)
+
+    start = time.perf_counter()
+    for _ in range(repeats // 100 or 1):
+        index = DataSetIndex(entries)
+    build_time = (time.perf_counter() - start) / (repeats // 100 or 1)
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for query in QUERIES:
+            index.search(query)
+    query_time = (time.perf_counter() - start) / (repeats * len(QUERIES))
+
+    data_set_size = os.path.getsize(data_set_path)
+    example_sizes = [len(format_examples(index.search(query))) for query in QUERIES]
+
+    print(f"Entries indexed:          {len(entries)}")
+    print(f"Index build time:         {build_time * 1000:.2f} ms")
+    print(f"Query time:               {query_time * 1000000:.1f} us")
+    print(f"Whole data set size:      {data_set_size} bytes")
+    print(f"Average inlined examples: {sum(example_sizes) / len(example_sizes):.0f} bytes")
+
+if __name__ == "__main__":
+    main()
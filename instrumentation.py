@@ -0,0 +1,126 @@
+import contextlib
+import contextvars
+import json
+import logging
+import time
+
+# The ID of the run the current code belongs to, added to every event.
+current_run_id = contextvars.ContextVar("current_run_id", default=None)
+
+class Stage():
+    """
+    A pipeline stage being timed. Code running in the stage adds
+    attributes to it, such as response sizes and issue counts.
+
+    Attributes:
+      name: The name of the stage.
+      attributes: The attributes recorded for the stage.
+    """
+    __slots__ = ("name", "attributes")
+
+    def __init__(self, name, attributes):
+        """
+        Initializes the stage.
+
+        Args:
+          name: The name of the stage.
+          attributes: The attributes known when the stage starts.
+        """
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        """
+        Adds attributes to the stage.
+        """
+        self.attributes.update(attributes)
+
+class NullStage():
+    """
+    Stands in for a Stage when instrumentation is disabled, so code can
+    set attributes without checking whether anything records them. It is
+    also a context manager that yields itself, so a disabled stage costs
+    no more than entering an empty with block.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        """
+        Ignores the attributes.
+        """
+
+NULL_STAGE = NullStage()
+
+class Instrumentation():
+    """
+    Records pipeline stages as structured log events, and optionally as
+    OpenTelemetry spans. Each event is a JSON object with the event name,
+    run ID, duration in milliseconds and the stage's attributes.
+
+    Attributes:
+      logger: The logger the events are written to at INFO level.
+      tracer: An OpenTelemetry tracer, or any object with a compatible
+        start_as_current_span method, or None to skip spans.
+    """
+    def __init__(self, logger=None, tracer=None):
+        """
+        Initializes the instrumentation.
+
+        Args:
+          logger: The logger for the events. Defaults to the "secogen" logger (optional).
+          tracer: A tracer for spans, such as opentelemetry.trace.get_tracer("secogen") (optional).
+        """
+        self.logger = logger or logging.getLogger("secogen")
+        self.tracer = tracer
+
+    @contextlib.contextmanager
+    def stage(self, name, **attributes):
+        """
+        Times a stage and records it when it ends, including the type of
+        any exception that ended it.
+
+        Args:
+          name: The name of the stage.
+          attributes: The attributes known when the stage starts (optional).
+        Yields:
+          The Stage, for adding attributes.
+        """
+        stage = Stage(name, attributes)
+        span_manager = self.tracer.start_as_current_span(f"secogen.{name}") if self.tracer else contextlib.nullcontext()
+
+        with span_manager as span:
+            start_time = time.perf_counter()
+            try:
+                yield stage
+            except BaseException as error:
+                stage.set(error=type(error).__name__)
+                raise
+            finally:
+                self.record(name, time.perf_counter() - start_time, span=span, **stage.attributes)
+
+    def record(self, name, seconds, span=None, **attributes):
+        """
+        Records a stage that has already been timed.
+
+        Args:
+          name: The name of the stage.
+          seconds: The duration of the stage.
+          span: The span to add the attributes to (optional).
+          attributes: The attributes of the stage (optional).
+        """
+        event = {"event": name, "run_id": current_run_id.get(), "duration_ms": round(seconds * 1000, 3)}
+        event.update(attributes)
+
+        if span is not None:
+            for key, value in event.items():
+                if value is not None and key != "event":
+                    span.set_attribute(f"secogen.{key}", value)
+
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(json.dumps(event, default=str))
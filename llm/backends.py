@@ -0,0 +1,98 @@
+try:
+    import google.generativeai as genai
+except ImportError:
+    genai = None
+
+class GenerationBackend():
+    """
+    The interface SecureCodeGen uses to talk to an LLM. It follows the
+    google.generativeai.GenerativeModel API, so Gemini needs no adapting
+    and other backends, such as offline stubs, can be swapped in.
+
+    Responses are objects with a text attribute. Streamed responses are
+    iterables of such objects.
+
+    Attributes:
+      name: Identifies the backend and its model, for example in the run
+        history.
+    """
+    name = "unknown"
+
+    def generate_content(self, contents, stream=False, request_options=None):
+        """
+        Generates a response.
+
+        Args:
+          contents: The prompt, or a list of the prompt and attached files.
+          stream: Indicates if the response should be returned in chunks (optional).
+          request_options: Options such as the request timeout (optional).
+        Returns:
+          The response, or an iterable of response chunks if streaming.
+        """
+        raise NotImplementedError
+
+    async def generate_content_async(self, contents, stream=False, request_options=None):
+        """
+        The asynchronous version of generate_content.
+
+        Args:
+          contents: The prompt, or a list of the prompt and attached files.
+          stream: Indicates if the response should be returned in chunks (optional).
+          request_options: Options such as the request timeout (optional).
+        Returns:
+          The response, or an asynchronous iterable of response chunks if streaming.
+        """
+        raise NotImplementedError
+
+    def upload_file(self, file_path):
+        """
+        Uploads a file so it can be attached to prompts.
+
+        Args:
+          file_path: The file to upload.
+        Returns:
+          An object with uri, mime_type and expiration_time attributes.
+        """
+        raise NotImplementedError
+
+class GeminiBackend(GenerationBackend):
+    """
+    Generates responses with Google Gemini.
+
+    Attributes:
+      name: The name of the Gemini model.
+      model: The google.generativeai.GenerativeModel used.
+    """
+    def __init__(self, api_key, model_type="gemini-1.5-flash"):
+        """
+        Configures the Gemini API.
+
+        Args:
+          api_key: The Gemini API key.
+          model_type: The name of the Gemini model (optional).
+        """
+        if genai is None:
+            raise ImportError("The Gemini backend needs google-generativeai. "
+                              "Install it with: pip install google-generativeai")
+
+        genai.configure(api_key=api_key)
+        self.name = model_type
+        self.model = genai.GenerativeModel(model_type)
+
+    def generate_content(self, contents, stream=False, request_options=None):
+        """
+        Generates a response with Gemini.
+        """
+        return self.model.generate_content(contents, stream=stream, request_options=request_options)
+
+    async def generate_content_async(self, contents, stream=False, request_options=None):
+        """
+        Generates a response with Gemini without blocking the event loop.
+        """
+        return await self.model.generate_content_async(contents, stream=stream, request_options=request_options)
+
+    def upload_file(self, file_path):
+        """
+        Uploads a file with the Gemini File API.
+        """
+        return genai.upload_file(file_path)
@@ -0,0 +1,108 @@
+import heapq
+import json
+import math
+import re
+from collections import Counter, defaultdict
+
+TOKEN_PATTERN = re.compile(r"[a-z][a-z0-9]+")
+
+class DataSetIndex():
+    """
+    A TF-IDF index over the entries of a SecurityEval style data set.
+
+    Each entry is indexed on its prompt and insecure code, and the index
+    is used to find the entries most relevant to a user prompt so only
+    those have to be sent to the LLM.
+
+    Attributes:
+      entries: The data set entries, as dictionaries with ID, Prompt and
+        Insecure_code keys.
+      postings: Maps each term to a list of (entry index, weight) pairs.
+      idf: Maps each term to its inverse document frequency.
+    """
+    def __init__(self, entries):
+        """
+        Builds the index.
+
+        Args:
+          entries: The data set entries to index.
+        """
+        self.entries = entries
+        self.postings = defaultdict(list)
+
+        term_counts = [Counter(tokenize(entry["Prompt"] + "\n" + entry["Insecure_code"])) for entry in entries]
+
+        document_frequency = Counter()
+        for counts in term_counts:
+            document_frequency.update(counts.keys())
+
+        self.idf = {term: math.log((1 + len(entries)) / (1 + frequency)) + 1
+                    for term, frequency in document_frequency.items()}
+
+        for entry_index, counts in enumerate(term_counts):
+            weights = {term: (1 + math.log(count)) * self.idf[term] for term, count in counts.items()}
+            norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+            for term, weight in weights.items():
+                self.postings[term].append((entry_index, weight / norm))
+
+    def search(self, query, top_k=5):
+        """
+        Finds the entries most relevant to the query by cosine similarity.
+
+        Args:
+          query: The text to search for, usually the user prompt.
+          top_k: The maximum number of entries to return (optional).
+        Returns:
+          A list of (score, entry) tuples, best match first. Entries that
+            share no terms with the query are never returned.
+        """
+        query_weights = {term: (1 + math.log(count)) * self.idf[term]
+                         for term, count in Counter(tokenize(query)).items() if term in self.idf}
+        query_norm = math.sqrt(sum(weight * weight for weight in query_weights.values())) or 1.0
+
+        scores = defaultdict(float)
+        for term, query_weight in query_weights.items():
+            for entry_index, weight in self.postings[term]:
+                scores[entry_index] += query_weight * weight / query_norm
+
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(score, self.entries[entry_index]) for entry_index, score in best]
+
+def tokenize(text):
+    """
+    Splits text into lowercase terms. Identifiers are split on
+    underscores and dots, so "yaml.safe_load" yields "yaml", "safe"
+    and "load".
+
+    Args:
+      text: The text to split.
+    Returns:
+      A list of terms.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+def load_data_set(file_path):
+    """
+    Reads a data set stored as one JSON object per line.
+
+    Args:
+      file_path: The path of the data set file.
+    Returns:
+      A list of the entries in the file.
+    """
+    with open(file_path) as data_set_file:
+        return [json.loads(line) for line in data_set_file if line.strip()]
+
+def format_examples(results):
+    """
+    Formats retrieved entries so they can be inlined into a prompt.
+
+    Args:
+      results: The (score, entry) tuples returned by DataSetIndex.search.
+    Returns:
+      The entries as text, one ID and insecure code block per entry.
+    """
+    examples = []
+    for _, entry in results:
+        examples.append(f"ID: {entry['ID']}\nInsecure code:\n```\n{entry['Insecure_code']}\n```")
+    return "\n\n".join(examples)
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Files uploaded to the Gemini API are kept for 48 hours.
+DEFAULT_FILE_LIFETIME = 48 * 60 * 60
+
+class DataSetUploader():
+    """
+    Uploads data set files to the LLM provider once and reuses the
+    remote file handle for later prompts.
+
+    Handles are keyed by the SHA-256 hash of the file contents, so a
+    file is only uploaded again when it changes or when its handle is
+    about to expire. Handles are shared between threads through an
+    in-memory table and between processes through a JSON state file.
+
+    Attributes:
+      state_file: The JSON file holding the known handles.
+      upload_function: The function used to upload a file. It receives a
+        file path and returns an object with uri, mime_type and
+        expiration_time attributes, like google.generativeai.upload_file.
+      expiry_margin: How many seconds before expiry a handle is replaced.
+      uploads: The number of uploads performed by this uploader.
+    """
+    def __init__(self, state_file, upload_function, expiry_margin=60 * 60):
+        """
+        Initializes the uploader.
+
+        Args:
+          state_file: The JSON file holding the known handles.
+          upload_function: The function used to upload a file.
+          expiry_margin: How many seconds before expiry a handle is
+            replaced (optional).
+        """
+        self.state_file = state_file
+        self.upload_function = upload_function
+        self.expiry_margin = expiry_margin
+        self.uploads = 0
+
+        self._handles = {}
+        self._file_hashes = {}
+        self._lock = threading.Lock()
+
+    def attachment(self, file_path):
+        """
+        Returns a prompt part referencing the uploaded copy of the file,
+        uploading it first if there is no usable handle.
+
+        Args:
+          file_path: The path of the file to attach.
+        Returns:
+          A file_data part that can be passed to generate_content.
+        """
+        content_hash = self._hash_file(file_path)
+
+        with self._lock:
+            handle = self._handles.get(content_hash)
+
+            if not self._is_usable(handle):
+                handle = self._read_state().get(content_hash)
+
+            if not self._is_usable(handle):
+                handle = self._upload(file_path)
+                self._write_state(content_hash, handle)
+
+            self._handles[content_hash] = handle
+
+        return {"file_data": {"file_uri": handle["uri"], "mime_type": handle["mime_type"]}}
+
+    def _upload(self, file_path):
+        """
+        Uploads the file and returns its handle as a dictionary.
+        """
+        uploaded_file = self.upload_function(file_path)
+        self.uploads += 1
+
+        expiration_time = getattr(uploaded_file, "expiration_time", None)
+        if expiration_time:
+            expires_at = expiration_time.timestamp()
+        else:
+            expires_at = time.time() + DEFAULT_FILE_LIFETIME
+
+        return {
+            "uri": uploaded_file.uri,
+            "mime_type": uploaded_file.mime_type,
+            "expires_at": expires_at,
+        }
+
+    def _is_usable(self, handle):
+        """
+        Checks that a handle exists and will not expire soon.
+        """
+        return handle is not None and handle["expires_at"] - self.expiry_margin > time.time()
+
+    def _hash_file(self, file_path):
+        """
+        Returns the SHA-256 hash of the file contents. The hash is only
+        recomputed when the file's size or modification time changes.
+        """
+        stat = os.stat(file_path)
+        file_key = (file_path, stat.st_size, stat.st_mtime_ns)
+
+        content_hash = self._file_hashes.get(file_key)
+        if content_hash is None:
+            with open(file_path, "rb") as data_set_file:
+                content_hash = hashlib.sha256(data_set_file.read()).hexdigest()
+            self._file_hashes[file_key] = content_hash
+
+        return content_hash
+
+    def _read_state(self):
+        """
+        Reads the handles saved by any process.
+        """
+        try:
+            with open(self.state_file) as state:
+                return json.load(state)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_state(self, content_hash, handle):
+        """
+        Saves a handle so other processes can reuse it. Expired handles
+        are dropped from the file.
+        """
+        state = {key: value for key, value in self._read_state().items() if self._is_usable(value)}
+        state[content_hash] = handle
+
+        state_dir = os.path.dirname(self.state_file)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial file.
+        temp_path = f"{self.state_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as state_file:
+            json.dump(state, state_file)
+        os.replace(temp_path, self.state_file)
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from llm.backends import GenerationBackend
+
+DEFAULT_RESPONSE = "```python\nprint(\"Hello, world!\")\n```\nSecurity report: this code has no known security issues."
+
+# The files of a recorded SeCoGen run, as found in the wrapper_Test folder.
+TEST_RUN_PASS_1_FILE_NAME = "test_gemini_output_pass_1.py"
+TEST_RUN_FINAL_FILE_NAME = "test_final_code.py"
+TEST_RUN_REPORT_FILE_NAME = "test_security_report.txt"
+
+class FakeAPIError(Exception):
+    """
+    An API error raised by FakeModel. Like the errors of the Google API
+    client, it carries the HTTP status code.
+
+    Attributes:
+      code: The HTTP status code of the error.
+    """
+    def __init__(self, code):
+        """
+        Initializes the error.
+
+        Args:
+          code: The HTTP status code of the error.
+        """
+        super().__init__(f"{code} Injected failure")
+        self.code = code
+
+class FakeModel(GenerationBackend):
+    """
+    A backend that answers without a network connection, for testing
+    and benchmarking SeCoGen offline.
+
+    Attributes:
+      name: Identifies the fake model in the run history.
+      respond: A function that receives the contents of a request and
+        returns the response text.
+      latency: The number of seconds each request takes.
+      chunk_size: The number of characters in each chunk of a streamed
+        response.
+      failure_rate: The fraction of requests that fail with failure_code.
+      failure_code: The HTTP status code of injected failures.
+      calls: The number of requests received.
+      failures: The number of requests that failed, including timeouts.
+      uploads: The number of files uploaded.
+      in_flight: The number of requests currently being answered.
+      max_in_flight: The largest number of requests answered at once.
+    """
+    def __init__(self, respond=None, latency=0.0, chunk_size=64, failure_rate=0.0, failure_code=429, seed=None,
+                 name="fake"):
+        """
+        Initializes the fake model.
+
+        Args:
+          respond: A function that receives the contents of a request and
+            returns the response text. If not given, every request is
+            answered with a small code block and report (optional).
+          latency: The number of seconds each request takes (optional).
+          chunk_size: The number of characters in each chunk of a
+            streamed response (optional).
+          failure_rate: The fraction of requests that fail (optional).
+          failure_code: The HTTP status code of injected failures (optional).
+          seed: The seed of the random choice of failing requests (optional).
+          name: Identifies the fake model in the run history (optional).
+        """
+        self.name = name
+        self.respond = respond or (lambda contents: DEFAULT_RESPONSE)
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.failure_rate = failure_rate
+        self.failure_code = failure_code
+        self.calls = 0
+        self.failures = 0
+        self.uploads = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def generate_content(self, contents, stream=False, request_options=None, **kwargs):
+        """
+        Answers a request, blocking for the configured latency. Streamed
+        responses spread the latency over their chunks. A request whose
+        timeout is shorter than the latency fails with a TimeoutError.
+        """
+        if stream:
+            return self._stream(contents)
+
+        self._begin()
+        try:
+            delay, error = self._outcome(request_options)
+            time.sleep(delay)
+            if error is not None:
+                self._fail(error)
+            return SimpleNamespace(text=self.respond(contents))
+        finally:
+            self._end()
+
+    async def generate_content_async(self, contents, stream=False, request_options=None, **kwargs):
+        """
+        Answers a request without blocking the event loop.
+        """
+        if stream:
+            return self._stream_async(contents)
+
+        self._begin()
+        try:
+            delay, error = self._outcome(request_options)
+            await asyncio.sleep(delay)
+            if error is not None:
+                self._fail(error)
+            return SimpleNamespace(text=self.respond(contents))
+        finally:
+            self._end()
+
+    def upload_file(self, file_path):
+        """
+        Pretends to upload a file. The fake file expires at once, so a real
+        backend sharing the upload state never reuses it.
+        """
+        with self._lock:
+            self.uploads += 1
+        return SimpleNamespace(uri=f"fake://files/{os.path.basename(file_path)}", mime_type="text/plain",
+                               expiration_time=datetime.now(timezone.utc))
+
+    def _outcome(self, request_options):
+        """
+        Decides how long a request takes and the error it fails with, if any.
+        """
+        timeout = (request_options or {}).get("timeout")
+        if timeout is not None and timeout < self.latency:
+            return timeout, TimeoutError("Injected timeout")
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+        if failed:
+            return self.latency, FakeAPIError(self.failure_code)
+        return self.latency, None
+
+    def _fail(self, error):
+        """
+        Records and raises a failed request.
+        """
+        with self._lock:
+            self.failures += 1
+        raise error
+
+    def _stream(self, contents):
+        """
+        Yields the response to a request in chunks. Injected failures are
+        raised before the first chunk.
+        """
+        self._begin()
+        try:
+            error = self._outcome(None)[1]
+            if error is not None:
+                self._fail(error)
+            chunks = self._chunks(self.respond(contents))
+            for chunk in chunks:
+                time.sleep(self.latency / len(chunks))
+                yield SimpleNamespace(text=chunk)
+        finally:
+            self._end()
+
+    async def _stream_async(self, contents):
+        """
+        Yields the response to a request in chunks without blocking the event loop.
+        """
+        self._begin()
+        try:
+            error = self._outcome(None)[1]
+            if error is not None:
+                self._fail(error)
+            chunks = self._chunks(self.respond(contents))
+            for chunk in chunks:
+                await asyncio.sleep(self.latency / len(chunks))
+                yield SimpleNamespace(text=chunk)
+        finally:
+            self._end()
+
+    def _chunks(self, text):
+        """
+        Splits response text into chunks of chunk_size characters.
+        """
+        return [text[index:index + self.chunk_size] for index in range(0, len(text), self.chunk_size)] or [""]
+
+    def _begin(self):
+        """
+        Records the start of a request.
+        """
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _end(self):
+        """
+        Records the end of a request.
+        """
+        with self._lock:
+            self.in_flight -= 1
+
+
+class ReplayBackend(FakeModel):
+    """
+    A backend that answers with recorded responses. Each rule pairs a
+    piece of prompt text with a response, and a request is answered with
+    the response of the first rule whose text appears in its prompt. The
+    same prompt always gets the same response, so runs are repeatable.
+
+    Attributes:
+      rules: A list of (prompt text, response) tuples. A rule with empty
+        prompt text matches every request.
+    """
+    def __init__(self, rules, **kwargs):
+        """
+        Initializes the backend.
+
+        Args:
+          rules: A list of (prompt text, response) tuples.
+          kwargs: The name, latency, chunk size and failure options of FakeModel (optional).
+        """
+        kwargs.setdefault("name", "replay")
+        super().__init__(self.replay, **kwargs)
+        self.rules = rules
+
+    @classmethod
+    def load(cls, file_name, **kwargs):
+        """
+        Loads rules from a file with one JSON object per line, holding a
+        "response" key and an optional "match" key with the prompt text.
+
+        Args:
+          file_name: The name of the file holding the rules.
+          kwargs: The name, latency, chunk size and failure options of FakeModel (optional).
+        Returns:
+          The backend.
+        """
+        kwargs.setdefault("name", f"replay:{file_name}")
+        rules = []
+        with open(file_name) as rules_file:
+            for line in rules_file:
+                if line.strip():
+                    entry = json.loads(line)
+                    rules.append((entry.get("match", ""), entry["response"]))
+        return cls(rules, **kwargs)
+
+    @classmethod
+    def from_test_run(cls, directory, **kwargs):
+        """
+        Builds rules that replay a recorded SeCoGen run, such as the one in
+        the wrapper_Test folder. The first request gets the pass 1 code,
+        repair requests get the final code, and report requests get the
+        security report.
+
+        Args:
+          directory: The folder holding the recorded run.
+          kwargs: The name, latency, chunk size and failure options of FakeModel (optional).
+        Returns:
+          The backend.
+        """
+        def read(file_name):
+            with open(os.path.join(directory, file_name)) as recorded_file:
+                return recorded_file.read()
+
+        kwargs.setdefault("name", f"replay:{directory}")
+        report = read(TEST_RUN_REPORT_FILE_NAME)
+        return cls([
+            ("Rewrite this code", f"```python\n{read(TEST_RUN_FINAL_FILE_NAME)}```\n\n{report}"),
+            ("report about the security", report),
+            ("", f"```python\n{read(TEST_RUN_PASS_1_FILE_NAME)}```\n\n{report}"),
+        ], **kwargs)
+
+    def replay(self, contents):
+        """
+        Returns the response of the first rule matching the request.
+        """
+        prompt = contents if isinstance(contents, str) else " ".join(part for part in contents if isinstance(part, str))
+        for text, response in self.rules:
+            if text in prompt:
+                return response
+        return DEFAULT_RESPONSE
@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+class RequestAbandoned(Exception):
+    """
+    Passed to the requests waiting for a coalesced request whose caller
+    gave up on it, such as by cancelling it, so one of them makes it instead.
+    """
+
+class ResponseCache():
+    """
+    A persistent cache of LLM responses stored in SQLite.
+
+    Entries expire after a time to live, and the least recently used
+    entries are evicted once the cache grows past max_entries. Concurrent
+    requests for the same key are coalesced, so only the first one
+    reaches the API and the others wait for its response. If the first
+    one is cancelled, a waiting request makes the call instead, and a
+    cancelled waiter does not affect the others.
+
+    Attributes:
+      db_path: The SQLite database file.
+      ttl: The number of seconds a response stays valid.
+      max_entries: The maximum number of responses kept.
+      hits: The number of lookups answered from the cache.
+      misses: The number of requests sent to the API.
+      coalesced: The number of requests that waited for an identical
+        request already in flight.
+    """
+    def __init__(self, db_path, ttl=24 * 60 * 60, max_entries=1024):
+        """
+        Opens the cache, creating the database if needed.
+
+        Args:
+          db_path: The SQLite database file.
+          ttl: The number of seconds a response stays valid (optional).
+          max_entries: The maximum number of responses kept (optional).
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._pending = {}
+
+        self._connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                                 "key TEXT PRIMARY KEY, response TEXT NOT NULL,"
+                                 " created REAL NOT NULL, last_used REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def get(self, key):
+        """
+        Looks up an unexpired response.
+
+        Args:
+          key: The request fingerprint.
+        Returns:
+          The cached response or None if there is none.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] + self.ttl < now:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return row[0]
+
+    def put(self, key, response):
+        """
+        Stores a response and evicts the least recently used entries if
+        the cache is full.
+
+        Args:
+          key: The request fingerprint.
+          response: The response text.
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, response, now, now))
+            self._connection.execute("DELETE FROM responses WHERE key NOT IN"
+                                     " (SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)",
+                                     (self.max_entries,))
+
+    def delete(self, key):
+        """
+        Removes a response, for example because it was unusable.
+
+        Args:
+          key: The request fingerprint.
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def fetch(self, key, request):
+        """
+        Returns the cached response for the key, or makes the request and
+        caches its response. Identical requests made at the same time share
+        one call.
+
+        Args:
+          key: The request fingerprint.
+          request: A function that makes the request and returns the response text.
+        Returns:
+          The response text.
+        """
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+
+            future, leader = self._claim(key)
+            if leader:
+                break
+            try:
+                return future.result()
+            except RequestAbandoned:
+                continue
+
+        try:
+            response = request()
+        except Exception as error:
+            self._release(key, future, error=error)
+            raise
+        except BaseException:
+            self._abandon(key, future)
+            raise
+        self._release(key, future, response=response)
+        return response
+
+    async def fetch_async(self, key, request):
+        """
+        The asynchronous version of fetch.
+
+        Args:
+          key: The request fingerprint.
+          request: A coroutine function that makes the request and returns
+            the response text.
+        Returns:
+          The response text.
+        """
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+
+            future, leader = self._claim(key)
+            if leader:
+                break
+            try:
+                # Shielded, so cancelling this waiter does not cancel the shared future.
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except RequestAbandoned:
+                continue
+
+        try:
+            response = await request()
+        except Exception as error:
+            self._release(key, future, error=error)
+            raise
+        except BaseException:
+            # The caller was cancelled, which is no reason to fail the waiting requests.
+            self._abandon(key, future)
+            raise
+        self._release(key, future, response=response)
+        return response
+
+    def _claim(self, key):
+        """
+        Registers a request for the key. Returns the future shared by all
+        requests for the key, and whether this request should make the call.
+        """
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+
+            self.misses += 1
+            future = Future()
+            self._pending[key] = future
+            return future, True
+
+    def _release(self, key, future, response=None, error=None):
+        """
+        Stores the response of a finished request and passes its result to
+        any waiting requests.
+        """
+        if error is None:
+            self.put(key, response)
+
+        with self._lock:
+            self._pending.pop(key, None)
+
+        if error is None:
+            future.set_result(response)
+        else:
+            future.set_exception(error)
+
+    def _abandon(self, key, future):
+        """
+        Gives up on a request whose caller stopped waiting for it, so the
+        next waiting request makes the call instead.
+        """
+        with self._lock:
+            self._pending.pop(key, None)
+        future.set_exception(RequestAbandoned())
+
+def fingerprint(*parts):
+    """
+    Computes a stable fingerprint of a request.
+
+    Args:
+      parts: The values that identify the request, such as the model type
+        and prompt. They must be JSON serializable.
+    Returns:
+      The hex digest of the request.
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
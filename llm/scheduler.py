@@ -0,0 +1,352 @@
+import asyncio
+import random
+import threading
+import time
+
+# The HTTP status codes of errors worth retrying: timeouts, rate limits and server errors.
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# The default quota of LLM requests per minute shared by the whole process.
+DEFAULT_REQUESTS_PER_MINUTE = 60
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling the API while the circuit breaker is open.
+    """
+
+class RateLimiter():
+    """
+    A token bucket rate limiter. Tokens are added at a fixed rate up to
+    the bucket's capacity, and each request takes one. Requests that find
+    the bucket empty reserve a future token and wait for it, so waiting
+    requests are served in order without polling.
+
+    Attributes:
+      rate: The number of tokens added per second, or None for no limit.
+      capacity: The largest number of requests that can be made at once.
+    """
+    def __init__(self, rate, capacity=1):
+        """
+        Initializes a full bucket.
+
+        Args:
+          rate: The number of tokens added per second, or None for no limit.
+          capacity: The largest number of requests that can be made at once (optional).
+        """
+        self.rate = rate
+        self.capacity = capacity
+
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Takes a token, reserving the next one if the bucket is empty.
+
+        Returns:
+          The number of seconds to wait before making the request.
+        """
+        if self.rate is None:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self):
+        """
+        Blocks until a request may be made.
+        """
+        time.sleep(self.reserve())
+
+    async def acquire_async(self):
+        """
+        Waits until a request may be made without blocking the event loop.
+        """
+        await asyncio.sleep(self.reserve())
+
+class CircuitBreaker():
+    """
+    Stops calls to a failing API. After failure_threshold failures in a
+    row the circuit opens and calls fail immediately. After reset_timeout
+    seconds one trial call is let through, and the circuit closes again
+    if it succeeds.
+
+    Attributes:
+      failure_threshold: The number of failures in a row that open the circuit.
+      reset_timeout: The number of seconds the circuit stays open.
+      failures: The number of failures in a row so far.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """
+        Initializes a closed circuit.
+
+        Args:
+          failure_threshold: The number of failures in a row that open the
+            circuit (optional).
+          reset_timeout: The number of seconds the circuit stays open (optional).
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        The state of the circuit: "closed", "open" or "half-open".
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._trial_running or time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def before_call(self):
+        """
+        Checks whether a call may be made.
+
+        Raises:
+          CircuitOpenError: If the circuit is open, or a trial call is already running.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._trial_running or time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError("The LLM API is failing, so calls are paused. Please retry later.")
+            self._trial_running = True
+
+    def record_success(self):
+        """
+        Records a call that reached the API, closing the circuit.
+        """
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def cancel_trial(self):
+        """
+        Records that a call ended without an answer or an API error, so
+        another trial call may be made.
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        """
+        Records a failed call, opening the circuit if there were too many.
+        """
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+class CallScheduler():
+    """
+    Makes LLM API calls with rate limiting, retries and deadlines. Failed
+    calls are retried with jittered exponential backoff if the error is
+    transient, and a circuit breaker stops calls while the API keeps
+    failing.
+
+    Attributes:
+      rate_limiter: The token bucket limiting the request rate.
+      circuit_breaker: The circuit breaker for the API.
+      max_retries: The maximum number of retries of a call.
+      base_delay: The backoff before the first retry, in seconds.
+      max_delay: The largest backoff between retries, in seconds.
+      request_timeout: The number of seconds a single request may take,
+        or None for no limit.
+      deadline: The number of seconds a call may take including its
+        retries, or None for no limit.
+      calls: The number of calls made.
+      retries: The number of retries made.
+      rejected: The number of calls rejected by the circuit breaker.
+    """
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, burst=10, max_retries=4, base_delay=1.0,
+                 max_delay=30.0, request_timeout=120, deadline=300, failure_threshold=5, reset_timeout=30):
+        """
+        Initializes the scheduler.
+
+        Args:
+          requests_per_minute: The maximum average request rate, or None for
+            no limit (optional).
+          burst: The largest number of requests that can be made at once (optional).
+          max_retries: The maximum number of retries of a call (optional).
+          base_delay: The backoff before the first retry, in seconds (optional).
+          max_delay: The largest backoff between retries, in seconds (optional).
+          request_timeout: The number of seconds a single request may take (optional).
+          deadline: The number of seconds a call may take including its retries (optional).
+          failure_threshold: The number of failures in a row that open the
+            circuit breaker (optional).
+          reset_timeout: The number of seconds the circuit breaker stays open (optional).
+        """
+        self.rate_limiter = RateLimiter(requests_per_minute / 60 if requests_per_minute else None, burst)
+        self.circuit_breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.request_timeout = request_timeout
+        self.deadline = deadline
+        self.calls = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def call(self, request):
+        """
+        Makes a call, retrying it if it fails with a transient error.
+
+        Args:
+          request: A function that makes the request. It receives the number
+            of seconds the request may take, or None for no limit.
+        Returns:
+          The result of the request.
+        Raises:
+          CircuitOpenError: If the circuit breaker is open.
+          TimeoutError: If the deadline passed before the call succeeded.
+        """
+        start_time = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            timeout = self._timeout(start_time)
+            self._before_attempt()
+            try:
+                result = request(timeout)
+            except Exception as error:
+                delay = self._after_failure(error, attempt, start_time)
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.circuit_breaker.cancel_trial()
+                raise
+
+            self.circuit_breaker.record_success()
+            return result
+
+    async def call_async(self, request):
+        """
+        The asynchronous version of call.
+
+        Args:
+          request: A coroutine function that makes the request. It receives
+            the number of seconds the request may take, or None for no limit.
+        Returns:
+          The result of the request.
+        Raises:
+          CircuitOpenError: If the circuit breaker is open.
+          TimeoutError: If the deadline passed before the call succeeded.
+        """
+        start_time = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire_async()
+            timeout = self._timeout(start_time)
+            self._before_attempt()
+            try:
+                result = await asyncio.wait_for(request(timeout), timeout)
+            except Exception as error:
+                delay = self._after_failure(error, attempt, start_time)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # The call was cancelled, which says nothing about the API.
+                self.circuit_breaker.cancel_trial()
+                raise
+
+            self.circuit_breaker.record_success()
+            return result
+
+    def _before_attempt(self):
+        """
+        Counts an attempt and checks the circuit breaker.
+        """
+        try:
+            self.circuit_breaker.before_call()
+        except CircuitOpenError:
+            self.rejected += 1
+            raise
+        self.calls += 1
+
+    def _timeout(self, start_time):
+        """
+        Returns the number of seconds the next request may take.
+        """
+        if self.deadline is None:
+            return self.request_timeout
+
+        remaining = self.deadline - (time.monotonic() - start_time)
+        if remaining <= 0:
+            raise TimeoutError(f"The LLM call did not succeed within {self.deadline} seconds.")
+        return remaining if self.request_timeout is None else min(self.request_timeout, remaining)
+
+    def _after_failure(self, error, attempt, start_time):
+        """
+        Records a failed attempt. Returns the backoff before the next retry,
+        or raises the error if the call should not be retried.
+        """
+        if not is_retryable(error):
+            # The API answered, so it is up even though the request was rejected.
+            self.circuit_breaker.record_success()
+            raise error
+
+        self.circuit_breaker.record_failure()
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        out_of_time = self.deadline is not None and time.monotonic() - start_time + delay >= self.deadline
+        if attempt == self.max_retries or out_of_time:
+            raise error
+
+        self.retries += 1
+        return delay
+
+def is_retryable(error):
+    """
+    Checks whether an API error is transient, such as a rate limit,
+    timeout or server error.
+
+    Args:
+      error: The exception raised by the API client.
+    Returns:
+      True if the call should be retried.
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, "code", None) in RETRYABLE_STATUS_CODES
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+def get_default_scheduler():
+    """
+    Returns the scheduler shared by every SecureCodeGen in the process,
+    so they stay within one rate limit together.
+
+    Returns:
+      The shared CallScheduler.
+    """
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = CallScheduler()
+        return _default_scheduler
+
+def request_options(timeout):
+    """
+    Builds the request options of a Gemini API call.
+
+    Args:
+      timeout: The number of seconds the request may take, or None for no limit.
+    Returns:
+      The request options, or None if there are none.
+    """
+    if timeout is None:
+        return None
+    return {"timeout": timeout}
@@ -0,0 +1,60 @@
+CODE_FENCE_START = "```python\n"
+CODE_FENCE_END = "```"
+
+class CodeBlockParser():
+    """
+    Finds the first python code block in a response while the response
+    is still arriving. It gives the same result as SecureCodeGen.parse_code
+    on the full text, but reports the code as soon as its closing fence
+    arrives.
+
+    Attributes:
+      code: The code block, or None until its closing fence has arrived.
+    """
+    def __init__(self):
+        """
+        Initializes an empty parser.
+        """
+        self.code = None
+
+        self._buffer = ""
+        self._code_start = None
+        self._scan_from = 0
+
+    @property
+    def text(self):
+        """
+        The response text received so far.
+        """
+        return self._buffer
+
+    def feed(self, chunk):
+        """
+        Adds the next chunk of the response.
+
+        Args:
+          chunk: The next piece of response text.
+        Returns:
+          The code block if this chunk completed it, otherwise None.
+        """
+        self._buffer += chunk
+        if self.code is not None:
+            return None
+
+        # Only search the new text, plus enough old text to catch a fence
+        # that was split between chunks.
+        if self._code_start is None:
+            start = self._buffer.find(CODE_FENCE_START, max(0, self._scan_from - len(CODE_FENCE_START) + 1))
+            if start == -1:
+                self._scan_from = len(self._buffer)
+                return None
+            self._code_start = start + len(CODE_FENCE_START)
+            self._scan_from = self._code_start
+
+        end = self._buffer.find(CODE_FENCE_END, max(self._code_start, self._scan_from - len(CODE_FENCE_END) + 1))
+        if end == -1:
+            self._scan_from = len(self._buffer)
+            return None
+
+        self.code = self._buffer[self._code_start:end]
+        return self.code
@@ -0,0 +1,155 @@
+import ast
+import re
+import textwrap
+
+# The number of unflagged lines shown around each flagged statement.
+CONTEXT_LINES = 3
+
+# Matches a replacement for one part of the code, such as "Part 2 (lines 10-14):" and its code block.
+PART_PATTERN = re.compile(r"Part (\d+)\b[^\n]*\n```python\n(.*?)```", re.DOTALL)
+IMPORTS_PATTERN = re.compile(r"Imports\b[^\n]*\n```python\n(.*?)```", re.DOTALL)
+
+def statement_spans(code):
+    """
+    Finds the lines of each statement in the code. Compound statements,
+    such as functions and loops, only span their header, so a finding in
+    a function's signature does not pull in its whole body.
+
+    Args:
+      code: The code, which must compile.
+    Returns:
+      A list of (first line, last line) tuples.
+    """
+    spans = []
+    for node in ast.walk(ast.parse(code)):
+        if not isinstance(node, ast.stmt):
+            continue
+        body = getattr(node, "body", None)
+        if isinstance(body, list) and body and isinstance(body[0], ast.stmt):
+            # Decorators come before the header.
+            first_line = min([node.lineno] + [decorator.lineno for decorator in getattr(node, "decorator_list", [])])
+            spans.append((first_line, max(first_line, body[0].lineno - 1)))
+        else:
+            spans.append((node.lineno, node.end_lineno))
+    return spans
+
+def find_regions(code, lines, context=CONTEXT_LINES):
+    """
+    Finds the parts of the code to send for a targeted repair. Each flagged
+    line is widened to the whole statement it belongs to, plus a few lines
+    of context that never split a statement. Overlapping and adjacent parts
+    are merged.
+
+    Args:
+      code: The code, which must compile.
+      lines: The flagged line numbers.
+      context: The number of lines of context around each statement (optional).
+    Returns:
+      A sorted list of (first line, last line) tuples.
+    """
+    code_lines = code.splitlines()
+    line_count = len(code_lines)
+    spans = statement_spans(code)
+
+    def widen(first_line, last_line):
+        # Grow the part until no statement crosses its edges.
+        changed = True
+        while changed:
+            changed = False
+            for span_first, span_last in spans:
+                if span_first <= last_line and span_last >= first_line and (span_first < first_line or span_last > last_line):
+                    first_line, last_line = min(first_line, span_first), max(last_line, span_last)
+                    changed = True
+        return first_line, last_line
+
+    regions = []
+    for line in sorted(set(lines)):
+        if not 1 <= line <= line_count:
+            continue
+        first_line, last_line = widen(line, line)
+        first_line, last_line = widen(max(1, first_line - context), min(line_count, last_line + context))
+        # Blank lines at the edges are left out, as replacements lose them.
+        while first_line < line and not code_lines[first_line - 1].strip():
+            first_line += 1
+        while last_line > line and not code_lines[last_line - 1].strip():
+            last_line -= 1
+        if regions and first_line <= regions[-1][1] + 1:
+            regions[-1] = (regions[-1][0], max(regions[-1][1], last_line))
+        else:
+            regions.append((first_line, last_line))
+    return regions
+
+def format_regions(code, regions):
+    """
+    Formats parts of the code for the targeted repair prompt. Each part
+    is numbered and labeled with its line numbers.
+
+    Args:
+      code: The code.
+      regions: The parts returned by find_regions.
+    Returns:
+      The text of the parts.
+    """
+    code_lines = code.splitlines()
+    parts = []
+    for number, (first_line, last_line) in enumerate(regions, start=1):
+        part = "\n".join(code_lines[first_line - 1:last_line])
+        parts.append(f"Part {number} (lines {first_line}-{last_line}):\n```python\n{part}\n```")
+    return "\n\n".join(parts)
+
+def parse_replacements(text):
+    """
+    Parses the response to a targeted repair prompt.
+
+    Args:
+      text: The response text.
+    Returns:
+      A tuple of a dictionary mapping part numbers to their new code, and
+        the code of the imports to add, or None if there are none.
+    """
+    replacements = {int(number): part for number, part in PART_PATTERN.findall(text)}
+    imports = IMPORTS_PATTERN.search(text)
+    return replacements, imports.group(1) if imports else None
+
+def apply_replacements(code, regions, replacements, imports=None):
+    """
+    Replaces parts of the code. Each replacement is re-indented to the
+    indentation of the part it replaces, and new imports are added after
+    the code's last top-level import.
+
+    Args:
+      code: The code, which must compile.
+      regions: The parts returned by find_regions.
+      replacements: A dictionary mapping part numbers to their new code.
+      imports: The code of the imports to add (optional).
+    Returns:
+      The new code, or None if no replacement or import matches the code.
+    """
+    code_lines = code.splitlines()
+    edits = []
+    for number, part in replacements.items():
+        if 1 <= number <= len(regions):
+            first_line, last_line = regions[number - 1]
+            indent = min((line[:len(line) - len(line.lstrip())] for line in code_lines[first_line - 1:last_line]
+                          if line.strip()), key=len, default="")
+            part = textwrap.indent(textwrap.dedent(part).strip("\n"), indent)
+            edits.append((first_line - 1, last_line, part.splitlines()))
+
+    if imports and imports.strip():
+        import_end = 0
+        for node in ast.parse(code).body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                import_end = node.end_lineno
+        # Flagged imports may be replaced, so add the new ones after such a part.
+        for first_line, last_line in regions:
+            if first_line <= import_end < last_line:
+                import_end = last_line
+        edits.append((import_end, import_end, textwrap.dedent(imports).strip("\n").splitlines()))
+
+    if not edits:
+        return None
+
+    # Edit the last lines first, so the line numbers of the other edits stay valid.
+    for start, end, lines in sorted(edits, key=lambda edit: (edit[0], edit[1]), reverse=True):
+        code_lines[start:end] = lines
+    return "\n".join(code_lines) + "\n"
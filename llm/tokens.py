@@ -0,0 +1,139 @@
+import math
+import threading
+from collections import Counter, deque
+
+# Gemini models average roughly four characters of English or code per token.
+CHARACTERS_PER_TOKEN = 4
+
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens the model will count for the text.
+
+    Args:
+      text: The text to measure.
+    Returns:
+      The estimated number of tokens.
+    """
+    return (len(text) + CHARACTERS_PER_TOKEN - 1) // CHARACTERS_PER_TOKEN
+
+def fit_to_budget(parts, budget, estimate=estimate_tokens, min_parts=0):
+    """
+    Counts how many of the leading parts fit in a token budget. Parts are
+    expected in order of importance, so the least important are dropped.
+
+    Args:
+      parts: The texts of the parts.
+      budget: The number of tokens available for the parts.
+      estimate: The function estimating the tokens of a text (optional).
+      min_parts: The number of parts kept even if they do not fit (optional).
+    Returns:
+      The number of leading parts to keep.
+    """
+    used = 0
+    for count, part in enumerate(parts):
+        used += estimate(part)
+        if used > budget and count >= min_parts:
+            return count
+    return len(parts)
+
+def usage_tokens(response):
+    """
+    Reads the token counts the model reported for a response.
+
+    Args:
+      response: A response returned by the backend.
+    Returns:
+      A tuple of the prompt and response token counts, each None if the
+        backend does not report it.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "prompt_token_count", None), getattr(usage, "candidates_token_count", None)
+
+class TokenUsage():
+    """
+    Compares the estimated token counts of LLM calls with the counts the
+    model reports, and calibrates later estimates with the difference.
+    It also counts the prompt components dropped to fit the budget.
+
+    Attributes:
+      calls: The estimated and reported token counts of the most recent
+        calls, as dictionaries.
+      trimmed: A Counter of the prompt components dropped, such as
+        examples and issues.
+    """
+    def __init__(self, max_calls=1000):
+        """
+        Initializes an empty record.
+
+        Args:
+          max_calls: The number of recent calls kept (optional).
+        """
+        self.calls = deque(maxlen=max_calls)
+        self.trimmed = Counter()
+        self._estimated_total = 0
+        self._reported_total = 0
+        self._lock = threading.Lock()
+
+    @property
+    def ratio(self):
+        """
+        The ratio of reported to estimated prompt tokens over every call
+        the model reported usage for, or 1.0 before there is any.
+        """
+        with self._lock:
+            if not self._estimated_total:
+                return 1.0
+            return self._reported_total / self._estimated_total
+
+    def estimate(self, text):
+        """
+        Estimates the tokens of a text, corrected by the ratio of reported
+        to estimated tokens so far.
+
+        Args:
+          text: The text to measure.
+        Returns:
+          The calibrated estimate.
+        """
+        return math.ceil(estimate_tokens(text) * self.ratio)
+
+    def record(self, prompt_tokens, response_tokens, reported_prompt_tokens, reported_response_tokens,
+               calibrate=True):
+        """
+        Records the token counts of one call.
+
+        Args:
+          prompt_tokens: The estimated prompt tokens.
+          response_tokens: The estimated response tokens.
+          reported_prompt_tokens: The prompt tokens the model reported, or None.
+          reported_response_tokens: The response tokens the model reported, or None.
+          calibrate: Indicates if the call should calibrate later estimates.
+            Calls with attached files should not, as the files are not
+            part of the estimate (optional).
+        Returns:
+          The recorded dictionary.
+        """
+        call = {
+            "prompt_tokens": prompt_tokens,
+            "response_tokens": response_tokens,
+            "reported_prompt_tokens": reported_prompt_tokens,
+            "reported_response_tokens": reported_response_tokens,
+        }
+        with self._lock:
+            self.calls.append(call)
+            if calibrate and reported_prompt_tokens is not None:
+                self._estimated_total += prompt_tokens
+                self._reported_total += reported_prompt_tokens
+        return call
+
+    def trim(self, component, count):
+        """
+        Counts prompt components dropped to fit the budget.
+
+        Args:
+          component: The kind of component, such as examples or issues.
+          count: The number dropped.
+        """
+        if count:
+            with self._lock:
+                self.trimmed[component] += count
@@ -1,17 +1,129 @@
+import argparse
+import json
+import logging
 import os
-from secure_code_gen import SecureCodeGen
+import re
+from instrumentation import Instrumentation
+from llm.fake_model import ReplayBackend
+from llm.scheduler import CallScheduler
+from run_store import RunStore
+from secure_code_gen import RUN_STORE_FILE_NAME, SecureCodeGen, get_file_path
+from service import SeCoGenService, create_server
+
+def load_prompts(prompt_file_name):
+    """
+    Loads prompts for a batch run. Each line of the file is either a JSON
+    object with a "prompt" key and an optional "id" key, or plain text.
+    Prompts without an ID, or whose ID is empty, "." or "..", are named
+    after their line number.
+
+    Args:
+      prompt_file_name: The name of the file holding the prompts.
+    Returns:
+      A list of (prompt ID, prompt) tuples.
+    """
+    prompts = []
+    prompt_ids = set()
+    with open(prompt_file_name) as prompt_file:
+        for line_number, line in enumerate(prompt_file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+
+            prompt_id = f"prompt_{line_number}"
+            if line.startswith("{"):
+                entry = json.loads(line)
+                prompt = entry["prompt"]
+                prompt_id = str(entry.get("id", prompt_id))
+            else:
+                prompt = line
+
+            # Prompt IDs are used as directory names.
+            prompt_id = re.sub(r"[^A-Za-z0-9._-]", "_", prompt_id)
+            if not prompt_id.strip("."):
+                # Empty, "." and ".." would put the run outside its own directory.
+                prompt_id = f"prompt_{line_number}"
+            if prompt_id in prompt_ids:
+                prompt_id = f"{prompt_id}_{line_number}"
+            prompt_ids.add(prompt_id)
+            prompts.append((prompt_id, prompt))
+    return prompts
 
 def main():
     """
     Main driver for testing SeCoGen framework.
     """
+    parser = argparse.ArgumentParser(description="Securely generate Python code with an LLM.")
+    parser.add_argument("--batch", help="a file of prompts to run instead of reading prompts interactively")
+    parser.add_argument("--serve", action="store_true", help="run an HTTP/JSON service instead of reading prompts")
+    parser.add_argument("--host", default="127.0.0.1", help="the address the service listens on")
+    parser.add_argument("--port", type=int, default=8000, help="the port the service listens on")
+    parser.add_argument("--queue-size", type=int, default=64,
+                        help="the number of service jobs that may wait for a worker before new ones are refused")
+    parser.add_argument("--output-dir", help="the directory for batch or service results"
+                                             " (default: output/batch or output/service)")
+    parser.add_argument("--concurrency", type=int, default=4, help="the number of batch prompts or service jobs run at once")
+    parser.add_argument("--replay", metavar="DIR",
+                        help="answer prompts offline by replaying a recorded run, such as wrapper_Test, instead of calling Gemini")
+    parser.add_argument("--latency", type=float, default=0.0, help="the seconds each replayed response takes")
+    parser.add_argument("--log-stages", action="store_true",
+                        help="log the duration, sizes and issue counts of each pipeline stage as JSON")
+    parser.add_argument("--no-history", action="store_true", help="do not record runs in the run store")
+    parser.add_argument("--targeted-repair", action="store_true",
+                        help="send only the flagged parts of the code in repair rounds and patch the fixes in")
+    parser.add_argument("--candidates", type=int, default=1,
+                        help="the number of first pass candidates requested at once, keeping the most secure")
+    parser.add_argument("--prompt-token-budget", type=int,
+                        help="the estimated tokens a prompt may use; examples, issues and code context are trimmed to fit")
+    args = parser.parse_args()
+
+    instrumentation = None
+    if args.log_stages:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        instrumentation = Instrumentation()
+
+    run_store = None
+    if not args.no_history:
+        run_store = RunStore(get_file_path(RUN_STORE_FILE_NAME))
+
     api_key = os.environ.get('GEMINI_API_KEY')
     if not api_key:
         api_key = ""
-    scg = SecureCodeGen(api_key)
+
+    if args.replay:
+        # Replayed responses have no quota, so do not rate limit them.
+        scg = SecureCodeGen(api_key, backend=ReplayBackend.from_test_run(args.replay, latency=args.latency),
+                            scheduler=CallScheduler(requests_per_minute=None), use_response_cache=False,
+                            instrumentation=instrumentation, run_store=run_store,
+                            targeted_repair=args.targeted_repair, candidates=args.candidates,
+                            prompt_token_budget=args.prompt_token_budget)
+    else:
+        scg = SecureCodeGen(api_key, instrumentation=instrumentation, run_store=run_store,
+                            targeted_repair=args.targeted_repair, candidates=args.candidates,
+                            prompt_token_budget=args.prompt_token_budget)
 
     print(" ==== Using the SeCoGen Framework ====\n")
 
+    if args.serve:
+        service = SeCoGenService(scg, args.output_dir or "output/service", workers=args.concurrency,
+                                 queue_size=args.queue_size)
+        server = create_server(service, args.host, args.port)
+        print(f"Serving on http://{args.host}:{server.server_port}. Press Ctrl+C to stop.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    if args.batch:
+        results = scg.generate_batch(load_prompts(args.batch), args.output_dir or "output/batch",
+                                     max_workers=args.concurrency)
+        succeeded = sum(1 for result in results.values() if isinstance(result, str))
+        print(f"Batch complete: {succeeded} of {len(results)} prompts generated code.")
+        return
+
     while True:
         user_prompt = input("Please enter a prompt or q to quit: ")
         if user_prompt == 'q':
@@ -19,4 +131,4 @@ def main():
         scg.generate(user_prompt)
 
 if __name__=="__main__":
-    main()
\ No newline at end of file
+    main()
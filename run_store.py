@@ -0,0 +1,326 @@
+import atexit
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    model TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    succeeded INTEGER NOT NULL,
+    final_pass INTEGER,
+    output_dir TEXT,
+    report TEXT,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_created ON runs (created);
+CREATE INDEX IF NOT EXISTS runs_model_created ON runs (model, created);
+
+CREATE TABLE IF NOT EXISTS passes (
+    run_id TEXT NOT NULL,
+    pass_number INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    PRIMARY KEY (run_id, pass_number)
+);
+
+CREATE TABLE IF NOT EXISTS findings (
+    run_id TEXT NOT NULL,
+    pass_number INTEGER NOT NULL,
+    test_id TEXT NOT NULL,
+    cwe INTEGER,
+    severity TEXT,
+    confidence TEXT,
+    line_number INTEGER,
+    issue_text TEXT
+);
+CREATE INDEX IF NOT EXISTS findings_run ON findings (run_id, pass_number);
+CREATE INDEX IF NOT EXISTS findings_test_id ON findings (test_id, run_id);
+CREATE INDEX IF NOT EXISTS findings_cwe ON findings (cwe, run_id);
+"""
+
+# Matches the CWE number in links such as https://cwe.mitre.org/data/definitions/259.html
+CWE_PATTERN = re.compile(r"(?:definitions/|CWE-)(\d+)")
+
+class RunStore():
+    """
+    An append-only history of SeCoGen runs stored in SQLite. It keeps each
+    run's prompt, model, the code and findings of every pass, the stage
+    timings and the security report, indexed so runs can be found by CWE,
+    Bandit ID, model and date.
+
+    Runs are written by a background thread in batches, so recording a
+    run never waits for the database.
+
+    Attributes:
+      db_path: The SQLite database file.
+      batch_size: The largest number of runs written in one transaction.
+      flush_interval: The longest time in seconds a recorded run waits
+        before it is written.
+      written: The number of runs written.
+    """
+    def __init__(self, db_path, batch_size=100, flush_interval=1.0):
+        """
+        Opens the store, creating the database if needed, and starts the
+        writer thread.
+
+        Args:
+          db_path: The SQLite database file.
+          batch_size: The largest number of runs written in one transaction (optional).
+          flush_interval: The longest time in seconds a recorded run waits
+            before it is written (optional).
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = self._connect()
+        self._connection.executescript(SCHEMA)
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="run-store-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def record_run(self, run):
+        """
+        Queues a run to be written. Returns immediately.
+
+        Args:
+          run: A dictionary with the run's run_id, created (a timestamp),
+            model, prompt, succeeded, final_pass, output_dir, report,
+            timings (a dictionary of stage durations) and passes (a list of
+            dictionaries with the code and findings of each pass, first
+            pass first).
+        """
+        self._queue.put(run)
+
+    def flush(self):
+        """
+        Blocks until every queued run has been written.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Writes the queued runs and stops the writer thread.
+        """
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def query_runs(self, cwe=None, test_id=None, model=None, since=None, until=None, final_only=False, limit=100):
+        """
+        Finds runs, newest first. Every given filter must match.
+
+        Args:
+          cwe: Only runs with a finding of this CWE number (optional).
+          test_id: Only runs with a finding of this Bandit ID, such as B105 (optional).
+          model: Only runs that used this model (optional).
+          since: Only runs created at or after this datetime or timestamp (optional).
+          until: Only runs created before this datetime or timestamp (optional).
+          final_only: Indicates if the CWE and Bandit ID filters only look
+            at the findings of each run's final pass (optional).
+          limit: The largest number of runs returned (optional).
+        Returns:
+          A list of dictionaries with each run's run_id, created, model,
+            prompt, succeeded, final_pass and output_dir.
+        """
+        conditions = []
+        parameters = []
+        if model is not None:
+            conditions.append("runs.model = ?")
+            parameters.append(model)
+        if since is not None:
+            conditions.append("runs.created >= ?")
+            parameters.append(to_timestamp(since))
+        if until is not None:
+            conditions.append("runs.created < ?")
+            parameters.append(to_timestamp(until))
+
+        for column, value in (("test_id", test_id), ("cwe", cwe)):
+            if value is None:
+                continue
+            final_condition = " AND findings.pass_number = runs.final_pass" if final_only else ""
+            conditions.append(f"EXISTS (SELECT 1 FROM findings WHERE findings.{column} = ?"
+                              f" AND findings.run_id = runs.run_id{final_condition})")
+            parameters.append(value)
+
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT run_id, created, model, prompt, succeeded, final_pass, output_dir FROM runs"
+                f"{where} ORDER BY created DESC LIMIT ?", parameters + [limit]).fetchall()
+        return [dict(row, succeeded=bool(row["succeeded"])) for row in rows]
+
+    def get_run(self, run_id):
+        """
+        Loads everything recorded about a run.
+
+        Args:
+          run_id: The ID of the run.
+        Returns:
+          A dictionary like the one passed to record_run, with the findings
+            of each pass as dictionaries of test_id, cwe, severity,
+            confidence, line_number and issue_text. None if there is no such run.
+        """
+        with self._lock:
+            run = self._connection.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            if run is None:
+                return None
+            passes = self._connection.execute("SELECT pass_number, code FROM passes WHERE run_id = ?"
+                                              " ORDER BY pass_number", (run_id,)).fetchall()
+            findings = self._connection.execute("SELECT pass_number, test_id, cwe, severity, confidence, line_number,"
+                                                " issue_text FROM findings WHERE run_id = ?", (run_id,)).fetchall()
+
+        run = dict(run)
+        run["succeeded"] = bool(run["succeeded"])
+        run["timings"] = json.loads(run["timings"]) if run["timings"] else {}
+        run["passes"] = [{"code": code, "findings": []} for _, code in passes]
+        for finding in findings:
+            finding = dict(finding)
+            run["passes"][finding.pop("pass_number") - 1]["findings"].append(finding)
+        return run
+
+    def finding_counts(self, model=None, since=None, until=None, final_only=True):
+        """
+        Counts findings by Bandit ID, for example to follow trends over time.
+
+        Args:
+          model: Only count runs that used this model (optional).
+          since: Only count runs created at or after this datetime or timestamp (optional).
+          until: Only count runs created before this datetime or timestamp (optional).
+          final_only: Indicates if only the findings of each run's final
+            pass are counted (optional).
+        Returns:
+          A dictionary mapping each Bandit ID to its number of findings,
+            most common first.
+        """
+        conditions = []
+        parameters = []
+        if final_only:
+            conditions.append("findings.pass_number = runs.final_pass")
+        if model is not None:
+            conditions.append("runs.model = ?")
+            parameters.append(model)
+        if since is not None:
+            conditions.append("runs.created >= ?")
+            parameters.append(to_timestamp(since))
+        if until is not None:
+            conditions.append("runs.created < ?")
+            parameters.append(to_timestamp(until))
+
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT findings.test_id, COUNT(*) AS count FROM findings"
+                f" JOIN runs ON runs.run_id = findings.run_id{where}"
+                " GROUP BY findings.test_id ORDER BY count DESC, findings.test_id", parameters).fetchall()
+        return {row["test_id"]: row["count"] for row in rows}
+
+    def _connect(self):
+        """
+        Opens a connection to the database in WAL mode, so reads are not
+        blocked by the writer.
+        """
+        connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _write_loop(self):
+        """
+        Writes queued runs in batches until close is called.
+        """
+        connection = self._connect()
+        stopping = False
+        while not stopping:
+            run = self._queue.get()
+            batch = []
+            if run is None:
+                stopping = True
+            else:
+                batch.append(run)
+
+            # Gather whatever else is queued, waiting briefly for more runs
+            # so a burst of runs shares one transaction.
+            while not stopping and len(batch) < self.batch_size:
+                try:
+                    run = self._queue.get(timeout=self.flush_interval if len(batch) < 2 else 0)
+                except queue.Empty:
+                    break
+                if run is None:
+                    stopping = True
+                else:
+                    batch.append(run)
+
+            try:
+                if batch:
+                    self._write_batch(connection, batch)
+                    self.written += len(batch)
+            except sqlite3.Error as error:
+                print(f"Error: {len(batch)} runs could not be saved to the run store: {error}")
+            finally:
+                for _ in range(len(batch) + (1 if stopping else 0)):
+                    self._queue.task_done()
+        connection.close()
+
+    def _write_batch(self, connection, batch):
+        """
+        Writes a batch of runs in one transaction.
+        """
+        runs = []
+        passes = []
+        findings = []
+        for run in batch:
+            runs.append((run["run_id"], run["created"], run["model"], run["prompt"], int(run["succeeded"]),
+                         run.get("final_pass"), run.get("output_dir"), run.get("report"),
+                         json.dumps(run.get("timings") or {})))
+            for pass_number, run_pass in enumerate(run.get("passes", []), start=1):
+                passes.append((run["run_id"], pass_number, run_pass["code"]))
+                for finding in run_pass["findings"]:
+                    findings.append((run["run_id"], pass_number, finding["test_id"], parse_cwe(finding.get("issue_cwe")),
+                                     finding.get("issue_severity"), finding.get("issue_confidence"),
+                                     finding.get("line_number"), finding.get("issue_text")))
+
+        connection.execute("BEGIN")
+        try:
+            connection.executemany("INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", runs)
+            connection.executemany("INSERT OR IGNORE INTO passes VALUES (?, ?, ?)", passes)
+            connection.executemany("INSERT INTO findings VALUES (?, ?, ?, ?, ?, ?, ?, ?)", findings)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+def parse_cwe(cwe):
+    """
+    Extracts the CWE number from a finding's CWE link or ID.
+
+    Args:
+      cwe: The issue_cwe field of a finding.
+    Returns:
+      The CWE number, or None if there is none.
+    """
+    if isinstance(cwe, int):
+        return cwe
+    match = CWE_PATTERN.search(cwe or "")
+    return int(match.group(1)) if match else None
+
+def to_timestamp(value):
+    """
+    Converts a datetime to a timestamp. Numbers are returned unchanged.
+    """
+    return value.timestamp() if isinstance(value, datetime) else value
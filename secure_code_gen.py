@@ -1,21 +1,61 @@
-import google.generativeai as genai
+import asyncio
+import contextlib
+import contextvars
+import functools
+import hashlib
+import itertools
 import re
 import os
 import shutil
-from bandit_analysis.result_analysis import result_analysis
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from bandit_analysis.analysis_cache import AnalysisCache
+from bandit_analysis.analyzers import AnalyzerPipeline, BanditAnalyzer, RedosAnalyzer
+from bandit_analysis.bandit_engine import BanditEngine, write_bandit_report
+from bandit_analysis.preflight import find_missing_imports, find_syntax_error
+from bandit_analysis.result_analysis import RANKING, filter_issues, format_issues, prioritize_findings
+from instrumentation import NULL_STAGE, current_run_id
+from llm.data_set_retrieval import DataSetIndex, format_examples, load_data_set
+from llm.backends import GeminiBackend
+from llm.data_set_upload import DataSetUploader
+from llm.response_cache import ResponseCache, fingerprint
+from llm.scheduler import get_default_scheduler, request_options
+from llm.streaming import CodeBlockParser
+from llm.targeted_repair import CONTEXT_LINES, apply_replacements, find_regions, format_regions, parse_replacements
+from llm.tokens import TokenUsage, estimate_tokens, fit_to_budget, usage_tokens
 
-PASS_1_PY_FILE_NAME = "generated_code/gemini_output_pass_1.py"
-PASS_1_BANDIT_REPORT_FILE_NAME = "reports/bandit_results_pass_1.csv"
+# The durations of the stages of the current run, summed by stage name,
+# or None when no run store records them.
+current_stage_times = contextvars.ContextVar("current_stage_times", default=None)
 
-PASS_2_BANDIT_REPORT_FILE_NAME = "reports/bandit_results_pass_2.csv"
-PASS_2_PY_FILE_NAME = "generated_code/gemini_output_pass_2.py"
+# The stage of the LLM call being made, which build_contents adds the size of the contents sent to.
+current_llm_stage = contextvars.ContextVar("current_llm_stage", default=NULL_STAGE)
 
-LLM_SECURITY_REPORT_FILE_NAME = "output/gemini_security_report.txt"
-FINAL_BANDIT_REPORT_FILE_NAME = "output/bandit_results_final.csv"
-FINAL_PY_FILE_NAME = "output/gemini_output_final.py"
+WORKSPACE_DIR_NAME = "generated_code"
+OUTPUT_DIR_NAME = "output"
+
+PASS_PY_FILE_NAME = "gemini_output_pass_{number}.py"
+
+LLM_SECURITY_REPORT_FILE_NAME = "gemini_security_report.txt"
+FINAL_BANDIT_REPORT_FILE_NAME = "bandit_results_final.csv"
+FINAL_PY_FILE_NAME = "gemini_output_final.py"
+MISSING_IMPORTS_FILE_NAME = "missing_imports.txt"
 
 DATA_SET_FILE_NAME = "data_sets/SecurityEval.txt"
 
+ANALYSIS_CACHE_DIR_NAME = "cache/analysis"
+# Bump when the format of cached analysis results changes.
+ANALYSIS_CACHE_VERSION = 4
+DATA_SET_UPLOAD_STATE_FILE_NAME = "cache/data_set_uploads.json"
+RESPONSE_CACHE_FILE_NAME = "cache/responses.sqlite3"
+
+RUN_STORE_FILE_NAME = "history/runs.sqlite3"
+
+# Targeted repair falls back to a full rewrite when the flagged parts are more than this fraction of the code.
+TARGETED_REPAIR_MAX_FRACTION = 0.5
+
 class SecureCodeGen():
     """
     This class contains functionality to securely prompt an LLM
@@ -25,49 +65,424 @@ class SecureCodeGen():
     To prompt, use the self.generate function.
 
     Attributes:
-      model: The model being used. Currently only interfaces
-        with Google Gemini.
+      model: The GenerationBackend used to generate responses. Gemini
+        unless another backend is given.
+      model_type: The name of the model being used.
+      scheduler: Rate limits and retries the LLM calls. Unless another
+        one is given, it is shared by every SecureCodeGen in the process.
+      response_cache: The cache of LLM responses, or None if responses
+        are not cached.
+      data_set_index: A TF-IDF index over the security data set, or None
+        if the whole data set is attached to prompts instead.
+      data_set_examples: The number of data set examples inlined into prompts.
+      data_set_uploader: Uploads the security data set once and reuses
+        the remote file handle across calls.
+      data_set_hash: The SHA-256 hash of the security data set.
+      bandit_engine: The in-process Bandit engine used for analysis.
+      analyzer_pipeline: Runs Bandit and the other analyzers in parallel.
+      analyzer_timings: The number of seconds each analyzer took, for the
+        most recent analyses. A timing is None if the analyzer timed out.
+      analysis_cache: The on-disk cache of analysis findings and issues.
+      analysis_cache_hits: The number of analyses served from the cache.
+      analysis_cache_misses: The number of analyses that ran the analyzers.
+      min_issue_severity: The lowest Bandit severity that is sent to the
+        LLM for repair.
+      min_issue_confidence: The lowest Bandit confidence that is sent to
+        the LLM for repair.
+      max_repair_rounds: The maximum number of times code is regenerated
+        to fix the issues found by Bandit.
+      repair_time_budget: The number of seconds after which no new repair
+        round is started, or None for no limit.
+      repair_token_budget: The estimated number of tokens after which no
+        new repair round is started, or None for no limit.
+      streaming: Indicates if responses are streamed, so Bandit can analyze
+        the code while the model is still writing the rest of the response.
+      time_to_first_analysis: The number of seconds from sending each
+        streamed request to starting the analysis of its code, for the
+        most recent requests.
+      stage_recorder: A function called with the name and duration in
+        seconds of each pipeline stage, or None to skip timing stages.
+        The stages are generate, upload, llm_pass_1, llm_repair, llm_report,
+        parse, analysis, result_analysis, write_code, save_report, publish,
+        and one per analyzer, such as bandit.
+      instrumentation: Records each stage with its duration, sizes, token
+        estimates and issue counts as a structured log event and optional
+        span, or None to disable instrumentation.
+      run_store: Records each run's prompt, the code and findings of each
+        pass, the stage timings and the security report, or None to keep
+        no history.
+      single_call: Indicates if the first prompt asks for the code and a
+        security report together, saving a separate report request when
+        the first pass is kept.
+      candidates: The number of first pass candidates requested in
+        parallel, each with a variant of the prompt. The first candidate
+        without issues is kept and the rest are cancelled. Otherwise, the
+        candidate with the least severe findings is kept. In generate, the
+        blocking calls of cancelled candidates run on until they finish and
+        still use quota. Only generate_async stops them.
+      prompt_token_budget: The estimated number of tokens a prompt may
+        use, or None for no limit. To fit it, the least relevant data set
+        examples and the lowest risk issues are dropped, and repair rounds
+        send only the flagged parts of the code if the whole code does not
+        fit. Attached files are not counted.
+      token_usage: The TokenUsage comparing the estimated and reported
+        token counts of each LLM call.
+      candidate_executor: The threads that make the blocking LLM calls of
+        generate when it requests several candidates, or None.
+      targeted_repair: Indicates if repair rounds send only the parts of
+        the code around the flagged lines and patch the LLM's replacements
+        into the code, instead of asking for a full rewrite. Rounds whose
+        replacements cannot be applied fall back to a full rewrite.
+      syntax_retries: The number of times the LLM is asked to fix code
+        that does not compile before the response is given up on.
+      syntax_errors: The number of responses whose code did not compile.
       secure_prompt: A message to ensure prompting is secure.
+      code_and_report_prompt: A message to ensure prompting is secure that
+        also asks for a security report, used in single call mode.
+      candidate_prompts: The variants added to the prompt of each first pass
+        candidate, used in turn. When they repeat, the candidate number is
+        added, so no two candidates share a prompt or a cached response.
       regenerate_prompt: A prompt to re-generate code based on
         issues identified by automated security testing.
+      targeted_repair_prompt: A prompt to fix only the flagged parts of the code.
       report_only_prompt: A prompt to ask only for a security report.
+      fix_syntax_prompt: A prompt to fix code that does not compile.
       warning_message: A message indicated code is LLM generated.
     """
-    def __init__(self, api_key, model_type="gemini-1.5-flash"):
+    def __init__(self, api_key, model_type="gemini-1.5-flash", analysis_cache_size=1024, data_set_examples=5,
+                 max_repair_rounds=3, repair_time_budget=None, repair_token_budget=None, single_call=True,
+                 use_response_cache=True, response_cache_ttl=24 * 60 * 60, response_cache_size=1024,
+                 streaming=False, min_issue_severity="LOW", min_issue_confidence="LOW", syntax_retries=1,
+                 scheduler=None, backend=None, instrumentation=None, run_store=None, targeted_repair=False,
+                 candidates=1, prompt_token_budget=None):
         """
         Initializes key features of the SecureCodeGen model.
 
         Args:
           api_key: The API key for the LLM being used to generate code.
           model_type: The type of model being used (optional).
+          analysis_cache_size: The maximum number of analysis results
+            kept in the cache (optional).
+          data_set_examples: The number of relevant data set examples to
+            inline into prompts. If 0, the whole data set is attached
+            instead (optional).
+          max_repair_rounds: The maximum number of repair rounds (optional).
+          repair_time_budget: The number of seconds after which no new
+            repair round is started (optional).
+          repair_token_budget: The estimated number of tokens after which
+            no new repair round is started (optional).
+          single_call: Indicates if the first prompt should also ask for a
+            security report (optional).
+          use_response_cache: Indicates if LLM responses should be cached (optional).
+          response_cache_ttl: The number of seconds a cached response stays
+            valid (optional).
+          response_cache_size: The maximum number of cached responses (optional).
+          streaming: Indicates if responses should be streamed (optional).
+          min_issue_severity: The lowest Bandit severity to repair (optional).
+          min_issue_confidence: The lowest Bandit confidence to repair (optional).
+          syntax_retries: The number of times to ask the LLM to fix code
+            that does not compile (optional).
+          scheduler: The CallScheduler used for LLM calls. Defaults to the
+            one shared by the process (optional).
+          backend: The GenerationBackend to use instead of Gemini, for
+            example a ReplayBackend for offline runs (optional).
+          instrumentation: The Instrumentation recording pipeline stages (optional).
+          run_store: The RunStore every run is recorded in (optional).
+          targeted_repair: Indicates if repair rounds should only send the
+            flagged parts of the code and patch the replies in (optional).
+          candidates: The number of first pass candidates requested at once,
+            of which the most secure is kept (optional).
+          prompt_token_budget: The estimated number of tokens a prompt may
+            use, or None for no limit (optional).
         """
-        genai.configure(api_key=api_key)
+        self.model = backend or GeminiBackend(api_key, model_type)
+        self.model_type = model_type
+        self.scheduler = scheduler or get_default_scheduler()
+
+        self.response_cache = None
+        if use_response_cache:
+            self.response_cache = ResponseCache(get_file_path(RESPONSE_CACHE_FILE_NAME),
+                                                ttl=response_cache_ttl,
+                                                max_entries=response_cache_size)
+
+        self.data_set_examples = data_set_examples
+        self.data_set_index = None
+        if data_set_examples:
+            self.data_set_index = DataSetIndex(load_data_set(get_file_path(DATA_SET_FILE_NAME)))
+        self.data_set_uploader = DataSetUploader(get_file_path(DATA_SET_UPLOAD_STATE_FILE_NAME), self.model.upload_file)
+        with open(get_file_path(DATA_SET_FILE_NAME), "rb") as data_set_file:
+            self.data_set_hash = hashlib.sha256(data_set_file.read()).hexdigest()
+
+        self.bandit_engine = BanditEngine()
+        # Code is only analyzed once it compiles, so there is no SyntaxAnalyzer here.
+        self.analyzer_pipeline = AnalyzerPipeline([BanditAnalyzer(self.bandit_engine), RedosAnalyzer()])
+        self.analyzer_timings = deque(maxlen=1000)
+        self.analysis_cache = AnalysisCache(get_file_path(ANALYSIS_CACHE_DIR_NAME),
+                                            f"{self.bandit_engine.signature}:{self.analyzer_pipeline.signature}"
+                                            f":v{ANALYSIS_CACHE_VERSION}",
+                                            max_entries=analysis_cache_size)
+        self.analysis_cache_hits = 0
+        self.analysis_cache_misses = 0
 
-        self.model = genai.GenerativeModel(model_type)
+        self.min_issue_severity = min_issue_severity
+        self.min_issue_confidence = min_issue_confidence
+        self.max_repair_rounds = max_repair_rounds
+        self.targeted_repair = targeted_repair
+        self.repair_time_budget = repair_time_budget
+        self.repair_token_budget = repair_token_budget
+        self.prompt_token_budget = prompt_token_budget
+        self.token_usage = TokenUsage()
+
+        self.streaming = streaming
+        self.time_to_first_analysis = deque(maxlen=1000)
+        self.stage_recorder = None
+        self.instrumentation = instrumentation
+        self.run_store = run_store
+
+        self.single_call = single_call
+
+        self.candidates = candidates
+        self.candidate_executor = None
+        if candidates > 1:
+            self.candidate_executor = ThreadPoolExecutor(thread_name_prefix="secogen-candidate")
+
+        self.syntax_retries = syntax_retries
+        self.syntax_errors = 0
 
         self.secure_prompt = "\nMake sure to make the code free from security vulnerabilities. Please only return code."
+        self.code_and_report_prompt = ("\nMake sure to make the code free from security vulnerabilities. Return the code"
+                                       " in a single python code block. After the code block, write a section that starts"
+                                       " with the heading \"Security report:\" containing a detailed report of the"
+                                       " security of the code you generate.")
 
+        self.candidate_prompts = ["",
+                                  " Validate every input and never hardcode secrets.",
+                                  " Prefer the standard library and its secure defaults.",
+                                  " Use parameterized queries and safe APIs for all file, network and process access."]
         self.regenerate_prompt = ("\nRewrite this code: {code} to fix these"
                                   " issues: {issues}. Additionally, write a detailed report of the security of the code you generate.")
+        self.targeted_repair_prompt = ("\nThese parts of a larger program have security issues: {issues}.\n\n{parts}\n\n"
+                                       "Fix the issues by changing only these parts. For each part you change, write its"
+                                       " heading followed by a python code block with the code that replaces all the lines"
+                                       " of the part, keeping their indentation. If the fix needs new imports, write the"
+                                       " heading \"Imports:\" followed by a python code block with the import statements."
+                                       " Please only return these headings and code blocks.")
         self.report_only_prompt = "Please write a detailed report about the security of this code: {code}."
+        self.fix_syntax_prompt = ("\nThis code does not compile because of \"{message}\" on line {line}: {code}"
+                                  " Fix the error without changing anything else. Please only return code.")
 
         self.warning_message = "# ===== LLM GENERATED CODE - USE WITH CAUTION =====\n"
 
-    def call_llm(self, prompt, include_data_set=False):
+    def call_llm(self, prompt, include_data_set=False, use_cache=True):
         """
-        Performs an API call to the current model.
+        Performs an API call to the current model through the scheduler.
+        Responses are cached, and identical calls made at the same time
+        share one API request.
 
         Args:
           prompt: The prompt to issue to the model.
           include_data_set: Indicates if the current security data
             set should be included (optional).
+          use_cache: Indicates if a cached response may be used. If not
+            set, the API is always called (optional).
+        """
+        def request():
+            contents = self.build_contents(prompt, include_data_set)
+            start_time = time.perf_counter()
+            response = self.scheduler.call(lambda timeout: self.model.generate_content(
+                contents, request_options=request_options(timeout)))
+            self._record_usage(contents, response.text, response, time.perf_counter() - start_time)
+            return response.text
+
+        if not use_cache or self.response_cache is None:
+            return request()
+        return self.response_cache.fetch(self.response_key(prompt, include_data_set), request)
+
+    async def call_llm_async(self, prompt, include_data_set=False, use_cache=True):
+        """
+        Performs an asynchronous API call to the current model. Responses
+        are cached, and identical calls made at the same time share one
+        API request.
+
+        Args:
+          prompt: The prompt to issue to the model.
+          include_data_set: Indicates if the current security data
+            set should be included (optional).
+          use_cache: Indicates if a cached response may be used. If not
+            set, the API is always called (optional).
+        """
+        async def request():
+            # Building the contents may upload the data set, so keep it off the event loop.
+            contents = await run_in_executor(self.build_contents, prompt, include_data_set)
+
+            async def attempt(timeout):
+                return await self.model.generate_content_async(contents, request_options=request_options(timeout))
+
+            start_time = time.perf_counter()
+            response = await self.scheduler.call_async(attempt)
+            self._record_usage(contents, response.text, response, time.perf_counter() - start_time)
+            return response.text
+
+        if not use_cache or self.response_cache is None:
+            return await request()
+        return await self.response_cache.fetch_async(self.response_key(prompt, include_data_set), request)
+
+    def stream_llm(self, prompt, include_data_set=False, use_cache=True):
+        """
+        Performs a streaming API call to the current model. A cached
+        response is returned as a single chunk. The scheduler retries the
+        call if it fails before the first chunk arrives.
+
+        Args:
+          prompt: The prompt to issue to the model.
+          include_data_set: Indicates if the current security data
+            set should be included (optional).
+          use_cache: Indicates if a cached response may be used (optional).
+        Yields:
+          The response text, one chunk at a time.
+        """
+        use_cache = use_cache and self.response_cache is not None
+        key = self.response_key(prompt, include_data_set)
+        cached = self.response_cache.get(key) if use_cache else None
+        if cached is not None:
+            yield cached
+            return
+
+        contents = self.build_contents(prompt, include_data_set)
+
+        def start(timeout):
+            stream = iter(self.model.generate_content(contents, stream=True, request_options=request_options(timeout)))
+            return next(stream, None), stream
+
+        start_time = time.perf_counter()
+        first_chunk, stream = self.scheduler.call(start)
+        chunks = []
+        last_chunk = first_chunk
+        if first_chunk is not None:
+            for chunk in itertools.chain([first_chunk], stream):
+                chunks.append(chunk.text)
+                last_chunk = chunk
+                yield chunk.text
+
+        # The usage of a streamed response is reported with its last chunk.
+        self._record_usage(contents, "".join(chunks), last_chunk, time.perf_counter() - start_time)
+        if use_cache:
+            self.response_cache.put(key, "".join(chunks))
+
+    async def stream_llm_async(self, prompt, include_data_set=False, use_cache=True):
+        """
+        Performs an asynchronous streaming API call to the current model.
+        A cached response is returned as a single chunk. The scheduler
+        retries the call if it fails before the first chunk arrives.
+
+        Args:
+          prompt: The prompt to issue to the model.
+          include_data_set: Indicates if the current security data
+            set should be included (optional).
+          use_cache: Indicates if a cached response may be used (optional).
+        Yields:
+          The response text, one chunk at a time.
+        """
+        use_cache = use_cache and self.response_cache is not None
+        key = self.response_key(prompt, include_data_set)
+        cached = self.response_cache.get(key) if use_cache else None
+        if cached is not None:
+            yield cached
+            return
+
+        contents = await run_in_executor(self.build_contents, prompt, include_data_set)
+
+        async def start(timeout):
+            response = await self.model.generate_content_async(contents, stream=True,
+                                                               request_options=request_options(timeout))
+            stream = response.__aiter__()
+            try:
+                return await stream.__anext__(), stream
+            except StopAsyncIteration:
+                return None, stream
+
+        start_time = time.perf_counter()
+        first_chunk, stream = await self.scheduler.call_async(start)
+        chunks = []
+        last_chunk = first_chunk
+        if first_chunk is not None:
+            chunks.append(first_chunk.text)
+            yield first_chunk.text
+            async for chunk in stream:
+                chunks.append(chunk.text)
+                last_chunk = chunk
+                yield chunk.text
+
+        # The usage of a streamed response is reported with its last chunk.
+        self._record_usage(contents, "".join(chunks), last_chunk, time.perf_counter() - start_time)
+        if use_cache:
+            self.response_cache.put(key, "".join(chunks))
+
+    def response_key(self, prompt, include_data_set=False):
+        """
+        Computes the response cache key of a call.
+
+        Args:
+          prompt: The prompt to issue to the model.
+          include_data_set: Indicates if the current security data
+            set should be included (optional).
+        Returns:
+          A fingerprint of the model type, prompt and data set.
+        """
+        if include_data_set:
+            if self.prompt_token_budget is not None:
+                # The budget decides how many examples are inlined.
+                return fingerprint(self.model_type, prompt, self.data_set_hash, self.data_set_examples,
+                                   self.prompt_token_budget)
+            return fingerprint(self.model_type, prompt, self.data_set_hash, self.data_set_examples)
+        return fingerprint(self.model_type, prompt)
+
+    def build_contents(self, prompt, include_data_set=False):
         """
-        if(include_data_set):
-            upload_file = genai.upload_file(get_file_path(DATA_SET_FILE_NAME))
-            response = self.model.generate_content([upload_file, prompt + " The attached file has IDs, prompts, and Insecure Code. Keep these in mind while generating the code."])
-        else:
-            response = self.model.generate_content(prompt)
-        return response.text
+        Builds the contents sent to the model for a prompt.
+
+        Args:
+          prompt: The prompt to issue to the model.
+          include_data_set: Indicates if the current security data
+            set should be included (optional).
+        Returns:
+          The prompt with any security data set examples inlined, or a list
+            holding the attached data set and the prompt. With a prompt token
+            budget, only the most relevant examples that fit are inlined.
+        """
+        contents = self._build_contents(prompt, include_data_set)
+        attached = not isinstance(contents, str)
+        text = " ".join(part for part in contents if isinstance(part, str)) if attached else contents
+        current_llm_stage.get().set(prompt_chars=len(text), prompt_tokens=estimate_tokens(text), attached=attached)
+        return contents
+
+    def _build_contents(self, prompt, include_data_set):
+        """
+        Builds the contents sent to the model for build_contents.
+        """
+        with self._stage("upload") as upload_stage:
+            examples = []
+            if include_data_set and self.data_set_index:
+                examples = self.data_set_index.search(prompt, self.data_set_examples)
+
+            examples_prompt = (prompt + " The following examples have IDs and Insecure Code."
+                               " Keep these in mind while generating the code.\n\n")
+            if examples and self.prompt_token_budget is not None:
+                kept = fit_to_budget([format_examples([example]) for example in examples],
+                                     self.prompt_token_budget - self.token_usage.estimate(examples_prompt),
+                                     self.token_usage.estimate)
+                self.token_usage.trim("examples", len(examples) - kept)
+                upload_stage.set(examples=kept, examples_dropped=len(examples) - kept)
+                examples = examples[:kept]
+                if not examples:
+                    return prompt
+
+            if examples:
+                return examples_prompt + format_examples(examples)
+            elif include_data_set:
+                data_set = self.data_set_uploader.attachment(get_file_path(DATA_SET_FILE_NAME))
+                return [data_set, prompt + " The attached file has IDs, prompts, and Insecure Code. Keep these in mind while generating the code."]
+            return prompt
 
     def parse_code(self, text):
         """
@@ -87,16 +502,62 @@ class SecureCodeGen():
 
         return None
 
-    def create_bandit_report(self, code_filename, bandit_report_filename):
+    def create_bandit_report(self, code, code_filename="./generated.py"):
+        """
+        Creates a Bandit report by scanning the given code with the
+        in-process Bandit engine. Nothing is written to disk.
+
+        Args:
+          code: The Python code to analyze.
+          code_filename: The name reported for the code in the findings (optional).
+        Returns:
+          A list of findings, one dictionary per issue found by Bandit.
+        """
+        return self.bandit_engine.scan(code, code_filename)
+
+    def analyze_code(self, code):
         """
-        Creates a Bandit report by making an OS system call to Bandit.
-        Assumes that Bandit has been installed by the user.
-        
+        Finds the security issues in the given code with Bandit and the
+        other analyzers, run in parallel. Results are cached by the
+        normalized code, so the analyzers only run on code they have not
+        seen before. Only the findings are cached, and the issues are built
+        from them on every call, so changes to the remediation registry
+        take effect at once. Bandit always finishes, but if another analyzer times
+        out or fails, the analysis is incomplete, a warning is printed and
+        the result is not cached.
+
         Args:
-          code_filename: The name of the Python file to analyze.
-          bandit_report_filename: The name of the target output file for Bandit.
+          code: The Python code to analyze.
+        Returns:
+          A tuple of the findings, the issues produced by prioritize_findings,
+            highest risk first, and whether every analyzer finished.
         """
-        os.system(f"bandit {code_filename} -f csv -o {bandit_report_filename}")
+        with self._stage("analysis", code_chars=len(code)) as analysis_stage:
+            cached = self.analysis_cache.get(code)
+            if cached is not None:
+                self.analysis_cache_hits += 1
+                issues = prioritize_findings(cached["findings"])
+                analysis_stage.set(cache_hit=True, findings=len(cached["findings"]), issues=len(issues))
+                return cached["findings"], issues, True
+
+            self.analysis_cache_misses += 1
+            findings, timings, complete = self.analyzer_pipeline.run(code)
+            self.analyzer_timings.append(timings)
+            for name, seconds in timings.items():
+                if seconds is not None:
+                    self._record_stage(name, seconds)
+
+            with self._stage("result_analysis", findings=len(findings)) as result_stage:
+                issues = prioritize_findings(findings)
+                result_stage.set(issues=len(issues))
+
+            if complete:
+                self.analysis_cache.put(code, {"findings": findings})
+            else:
+                missing = ", ".join(name for name, seconds in timings.items() if seconds is None)
+                print(f"Warning: the {missing} analysis did not finish, so its issues are missing.")
+            analysis_stage.set(cache_hit=False, complete=complete, findings=len(findings), issues=len(issues))
+            return findings, issues, complete
 
     def generate_python_script(self, output_file: str, gemini_output: str):
         """
@@ -108,11 +569,12 @@ class SecureCodeGen():
         """
         file_name = get_file_path(output_file)
 
-        with open(file_name, "w") as file_to_write:
-            file_to_write.write(self.warning_message)
-            file_to_write.write(gemini_output)
+        with self._stage("write_code", code_chars=len(gemini_output)):
+            with open(file_name, "w") as file_to_write:
+                file_to_write.write(self.warning_message)
+                file_to_write.write(gemini_output)
 
-    def generate(self, prompt):
+    def generate(self, prompt, output_dir=None, use_cache=True):
         """
         This is the heart of SeCoGen.
 
@@ -120,77 +582,675 @@ class SecureCodeGen():
         Generates a Python file from the generated code.
         Uses Bandit to perform automatic static analysis on the generated code.
 
-        Re-prompts the LLM if any security issues were found by Bandit.
+        Re-prompts the LLM if any security issues were found by Bandit,
+        until the issues are fixed, stop decreasing, or the repair budget
+        runs out.
 
         Ask the LLM to generate a security report on the final code.
 
-        Collects the generated code, final Bandit report, and LLM
-        security report and places them all into the output folder.
+        Each run works in its own workspace under the generated_code folder.
+        The generated code, final Bandit report, and LLM security report
+        are published together into a new directory named after the run ID
+        in the output folder.
+
+        This function blocks until the run is complete and cannot be called
+        while an event loop is running. Use generate_async there instead.
+        With several candidates, the LLM calls are made on threads, which
+        cannot be interrupted, so the calls of cancelled candidates still
+        finish and use quota.
 
         Args:
           prompt: The prompt issued by the user.
+          output_dir: The directory in which the run's output directory is
+            created. Defaults to the output folder (optional).
+          use_cache: Indicates if cached LLM responses may be used (optional).
+        Returns:
+          The run's output directory, or None if no code was generated.
         """
-        # Generate the first pass of the code
-        response1 = self.call_llm(prompt + self.secure_prompt, include_data_set=True)
-        pass_1_code = self.parse_code(response1)
+        async def call_llm(prompt, include_data_set=False):
+            if self.candidate_executor is not None:
+                # Candidates are requested at once, so make the blocking calls on threads.
+                return await run_in_executor(self.call_llm, prompt, include_data_set, use_cache,
+                                             executor=self.candidate_executor)
+            return self.call_llm(prompt, include_data_set, use_cache)
 
-        if not pass_1_code:
-            print("Error: no code was generated by initial prompt. Please retry or modify input prompt.")
-            return
+        async def stream_llm(prompt, include_data_set=False):
+            chunks = self.stream_llm(prompt, include_data_set, use_cache)
+            if self.candidate_executor is None:
+                for chunk in chunks:
+                    yield chunk
+                return
+
+            while True:
+                chunk = await run_in_executor(next, chunks, None, executor=self.candidate_executor)
+                if chunk is None:
+                    return
+                yield chunk
+
+        return asyncio.run(self._generate(prompt, output_dir, call_llm, stream_llm))
+
+    async def generate_async(self, prompt, output_dir=None, use_cache=True):
+        """
+        The asynchronous version of generate. LLM calls use the model's
+        asynchronous client and Bandit analysis and file output run in an
+        executor, so one event loop can drive many generations at once.
+
+        Args:
+          prompt: The prompt issued by the user.
+          output_dir: The directory in which the run's output directory is
+            created. Defaults to the output folder (optional).
+          use_cache: Indicates if cached LLM responses may be used (optional).
+        Returns:
+          The run's output directory, or None if no code was generated.
+        """
+        return await self._generate(prompt, output_dir,
+                                    functools.partial(self.call_llm_async, use_cache=use_cache),
+                                    functools.partial(self.stream_llm_async, use_cache=use_cache))
+
+    async def _generate(self, prompt, output_dir, call_llm, stream_llm):
+        """
+        Runs the SeCoGen pipeline shared by generate and generate_async.
+
+        Args:
+          prompt: The prompt issued by the user.
+          output_dir: The directory in which the run's output directory is
+            created, or None to use the output folder.
+          call_llm: A coroutine function with the same arguments as call_llm.
+          stream_llm: An asynchronous generator function with the same
+            arguments as stream_llm.
+        Returns:
+          The run's output directory, or None if no code was generated.
+        """
+        # Every run works in its own workspace, so concurrent runs never share files.
+        run_id = new_run_id()
+        workspace = get_file_path(os.path.join(WORKSPACE_DIR_NAME, run_id))
+        os.makedirs(workspace)
+
+        run_id_token = current_run_id.set(run_id)
+        stage_times_token = current_stage_times.set({} if self.run_store is not None else None)
+        created = time.time()
+        passes = []
+        final_code = response2 = run_output_dir = None
+        succeeded = False
+        try:
+            with self._stage("generate", prompt_chars=len(prompt)) as run_stage:
+                # Generate the first pass of the code
+                first_prompt = self.code_and_report_prompt if self.single_call else self.secure_prompt
+                if self.candidates > 1:
+                    response1, pass_1_code, analysis = await self._request_candidates(prompt, first_prompt,
+                                                                                      call_llm, stream_llm)
+                else:
+                    response1, pass_1_code, analysis = await self._request_code(prompt + first_prompt, True, call_llm,
+                                                                                stream_llm, "llm_pass_1")
+
+                if not pass_1_code:
+                    # Do not serve the unusable response again when the prompt is retried.
+                    if self.response_cache is not None:
+                        self.response_cache.delete(self.response_key(prompt + first_prompt, include_data_set=True))
+                    print("Error: no usable code was generated by initial prompt. Please retry or modify input prompt.")
+                    run_stage.set(succeeded=False)
+                    return None
+
+                # Save the generated code to file.
+                self.generate_python_script(os.path.join(workspace, PASS_PY_FILE_NAME.format(number=1)), pass_1_code)
+
+                # The Bandit report was generated and analyzed to find security issues.
+                findings, issues, complete = analysis
+                passes.append({"code": pass_1_code, "findings": findings})
+
+                # If issues were found, ask the LLM to regenerate the code to fix those issues.
+                final_code, final_findings, response2, final_complete = await self._repair(
+                    pass_1_code, findings, issues, complete, call_llm, stream_llm, workspace, passes)
+
+                if response2 is None and self.single_call and final_code == pass_1_code:
+                    # If the first pass is kept, use the report that came with it.
+                    response2 = self.extract_security_report(response1, required=True)
+
+                if response2 is None:
+                    # If there is no report yet, generate only the security report.
+                    report_prompt = self.report_only_prompt.format(code=final_code)
+                    with self._llm_stage("llm_report") as report_stage:
+                        response2 = await call_llm(report_prompt)
+                        report_stage.set(response_chars=len(response2), response_tokens=estimate_tokens(response2))
+
+                # Write the final code, Bandit report and AI security report, then
+                # publish the workspace to the output folder.
+                run_output_dir = os.path.join(get_file_path(output_dir or OUTPUT_DIR_NAME), run_id)
+                with self._stage("publish"):
+                    await run_in_executor(self._write_final_output, workspace, run_output_dir,
+                                          final_code, final_findings, final_complete, response2)
+
+                run_stage.set(succeeded=True, issues_before_repair=len(findings),
+                              issues_after_repair=len(final_findings), analysis_complete=final_complete)
+                succeeded = True
+        finally:
+            if self.run_store is not None:
+                self._record_run(run_id, created, prompt, passes, final_code, succeeded,
+                                 run_output_dir if succeeded else None,
+                                 self.extract_security_report(response2) if response2 else None)
+            current_stage_times.reset(stage_times_token)
+            current_run_id.reset(run_id_token)
+            shutil.rmtree(workspace, ignore_errors=True)
+
+        print(f"\nGenerated code, Bandit analysis, and LLM security report are located in {run_output_dir}.\n")
+        return run_output_dir
+
+    async def _request_candidates(self, prompt, first_prompt, call_llm, stream_llm):
+        """
+        Requests several first pass candidates at once, each with a variant
+        of the prompt, and analyzes each one as it arrives. The first
+        candidate without issues is kept and the others are cancelled.
+        Otherwise, the candidate with the least severe findings is kept,
+        preferring the one that arrived first.
+
+        Args:
+          prompt: The prompt issued by the user.
+          first_prompt: The instructions added to the end of the prompt.
+          call_llm: A coroutine function with the same arguments as call_llm.
+          stream_llm: An asynchronous generator function with the same
+            arguments as stream_llm.
+        Returns:
+          A tuple of the response text, the code, and the findings and issues
+            returned by analyze_code, like _request_code.
+        """
+        prompts = []
+        for number in range(self.candidates):
+            variant = self.candidate_prompts[number % len(self.candidate_prompts)]
+            if number >= len(self.candidate_prompts):
+                # Number the repeated variants, so each candidate is a separate request.
+                variant += f" This is candidate {number + 1}."
+            prompts.append(prompt + variant + first_prompt)
+        async def request(number):
+            return number, await self._request_code(prompts[number], True, call_llm, stream_llm, "llm_pass_1")
 
-        # Save the generated code to file.
-        self.generate_python_script(PASS_1_PY_FILE_NAME, pass_1_code)
+        tasks = [asyncio.ensure_future(request(number)) for number in range(self.candidates)]
 
-        # Identify file paths.
-        code_file_path = get_file_path(PASS_1_PY_FILE_NAME)
-        bandit_report_file_path = get_file_path(PASS_2_BANDIT_REPORT_FILE_NAME)
+        with self._stage("candidates", count=self.candidates) as candidates_stage:
+            best, best_risk, best_number, first_response = None, None, None, None
+            errors = []
+            try:
+                for next_candidate in asyncio.as_completed(tasks):
+                    try:
+                        number, candidate = await next_candidate
+                    except Exception as error:
+                        # Another candidate may still succeed.
+                        errors.append(error)
+                        continue
 
-        # Generate the Bandit report for the generated code.
-        self.create_bandit_report(code_file_path, bandit_report_file_path)
+                    response, code, analysis = candidate
+                    if first_response is None:
+                        first_response = response
+                    if not code:
+                        continue
 
-        # Analyze the Bandit report to find security issues.
-        issues = result_analysis(bandit_report_file_path)
+                    issues = filter_issues(analysis[1], self.min_issue_severity, self.min_issue_confidence)
+                    risk = severity_counts(issues)
+                    if best is None or risk < best_risk:
+                        best, best_risk, best_number = candidate, risk, number
+                    if not issues:
+                        # A clean candidate cannot be beaten, so stop waiting for the others.
+                        break
+            finally:
+                cancelled = 0
+                for task in tasks:
+                    if not task.done():
+                        task.cancel()
+                        cancelled += 1
+                await asyncio.gather(*tasks, return_exceptions=True)
+                candidates_stage.set(cancelled=cancelled, kept=best_number, failed=len(errors),
+                                     kept_findings=sum(best_risk) if best_risk is not None else None)
 
-        if issues:
-            # If issues were found, ask the LLM to regenerate the code to fix those issues.
-            response2 = self.call_llm(self.regenerate_prompt.format(
-                code=pass_1_code,
-                issues=issues
-            ))
+        if len(errors) == len(tasks):
+            raise errors[0]
+        if best is None:
+            for candidate_prompt in prompts[1:]:
+                if self.response_cache is not None:
+                    self.response_cache.delete(self.response_key(candidate_prompt, include_data_set=True))
+            return first_response, None, None
+        return best
 
-            # Extract the regenerated code.
-            pass_2_code = self.parse_code(response2)
+    async def _request_code(self, prompt, include_data_set, call_llm, stream_llm, stage):
+        """
+        Asks the LLM for code and analyzes the code it returns. Code that
+        does not compile is not analyzed. Instead, the LLM is asked to fix
+        the syntax error, up to syntax_retries times.
+
+        Args:
+          prompt: The prompt to issue to the model.
+          include_data_set: Indicates if the current security data
+            set should be included.
+          call_llm: A coroutine function with the same arguments as call_llm.
+          stream_llm: An asynchronous generator function with the same
+            arguments as stream_llm.
+          stage: The name of the pipeline stage the LLM calls are timed as.
+        Returns:
+          A tuple of the response text, the code, and the findings and issues
+            returned by analyze_code. The code and analysis are None if the
+            response has no code or its code still does not compile.
+        """
+        response, code, error, analysis = await self._request_code_once(prompt, include_data_set,
+                                                                        call_llm, stream_llm, stage)
+
+        retries = 0
+        while code and error is not None:
+            self.syntax_errors += 1
+            # Do not serve the broken response again.
+            if self.response_cache is not None:
+                self.response_cache.delete(self.response_key(prompt, include_data_set))
+
+            if retries == self.syntax_retries:
+                print(f"Error: the generated code does not compile: {error[1]} (line {error[0]}).")
+                return response, None, None
+
+            retries += 1
+            prompt = self.fix_syntax_prompt.format(message=error[1], line=error[0], code=code)
+            include_data_set = False
+            response, code, error, analysis = await self._request_code_once(prompt, include_data_set,
+                                                                            call_llm, stream_llm, stage)
+
+        return response, code, analysis
+
+    async def _request_code_once(self, prompt, include_data_set, call_llm, stream_llm, stage):
+        """
+        Makes one request for code, checks that the code compiles, and
+        analyzes it if it does. When streaming, the check and analysis start
+        as soon as the code block is complete, while the rest of the
+        response is still arriving.
+
+        Args:
+          prompt: The prompt to issue to the model.
+          include_data_set: Indicates if the current security data
+            set should be included.
+          call_llm: A coroutine function with the same arguments as call_llm.
+          stream_llm: An asynchronous generator function with the same
+            arguments as stream_llm.
+          stage: The name of the pipeline stage the LLM call is timed as.
+        Returns:
+          A tuple of the response text, the code, the line number and message
+            of its syntax error, and the findings and issues returned by
+            analyze_code. The syntax error is None if the code compiles, and
+            the analysis is None if there is no code or it does not compile.
+        """
+        if not self.streaming:
+            with self._llm_stage(stage) as llm_stage:
+                response = await call_llm(prompt, include_data_set=include_data_set)
+                llm_stage.set(response_chars=len(response), response_tokens=estimate_tokens(response))
+            with self._stage("parse", response_chars=len(response)) as parse_stage:
+                code = self.parse_code(response)
+                parse_stage.set(code_chars=len(code or ""))
+            error = find_syntax_error(code) if code else None
+            analysis = None
+            if code and error is None:
+                analysis = await run_in_executor(self.analyze_code, code)
+            return response, code, error, analysis
+
+        start_time = time.monotonic()
+        parser = CodeBlockParser()
+        error = None
+        analysis = None
+        with self._llm_stage(stage, streaming=True) as llm_stage:
+            async for chunk in stream_llm(prompt, include_data_set=include_data_set):
+                if parser.feed(chunk) is not None and parser.code:
+                    error = find_syntax_error(parser.code)
+                    if error is None:
+                        self.time_to_first_analysis.append(time.monotonic() - start_time)
+                        llm_stage.set(time_to_code_ms=round((time.monotonic() - start_time) * 1000, 3))
+                        analysis = run_in_executor(self.analyze_code, parser.code)
+            llm_stage.set(response_chars=len(parser.text), response_tokens=estimate_tokens(parser.text),
+                          code_chars=len(parser.code or ""))
+
+        if analysis is not None:
+            analysis = await analysis
+        return parser.text, parser.code, error, analysis
+
+    async def _repair(self, code, findings, issues, complete, call_llm, stream_llm, workspace, passes):
+        """
+        Repeatedly asks the LLM to fix the issues Bandit found in the code.
+        Each round only sends the issues that are still unresolved and meet
+        the severity and confidence thresholds, highest risk first.
+
+        Repair stops when no such issues are left, when a round does not
+        lower their risk, when the LLM returns no code, or when the time or
+        token budget is used up. Risk is compared by severity_counts, so
+        fewer high severity findings beat any number of lower severity
+        ones. The version of the code with the lowest risk is kept.
+
+        With targeted_repair, each round first asks for replacements of the
+        flagged parts only, and asks for a full rewrite if they cannot be
+        applied.
+
+        Args:
+          code: The first pass of the code.
+          findings: The Bandit findings for the first pass.
+          issues: The issues produced by prioritize_findings for the first pass.
+          complete: Indicates if every analyzer finished on the first pass.
+          call_llm: A coroutine function with the same arguments as call_llm.
+          stream_llm: An asynchronous generator function with the same
+            arguments as stream_llm.
+          workspace: The run's workspace directory.
+          passes: The code and findings of each pass so far. The passes of
+            the repair rounds are appended to it.
+        Returns:
+          A tuple of the best code, its findings, the LLM response that
+            produced it, and whether every analyzer finished on it. The
+            response is None if the first pass is kept or the code was
+            patched, as there is no report on the whole code then.
+        """
+        start_time = time.monotonic()
+        tokens_used = 0
+
+        issues = filter_issues(issues, self.min_issue_severity, self.min_issue_confidence)
+        best_code, best_findings, best_response, best_complete = code, findings, None, complete
+        best_risk = severity_counts(issues)
+
+        for round_number in range(2, self.max_repair_rounds + 2):
+            if not issues:
+                break
+            if self.repair_time_budget is not None and time.monotonic() - start_time >= self.repair_time_budget:
+                break
+            if self.repair_token_budget is not None and tokens_used >= self.repair_token_budget:
+                break
 
-            if pass_2_code:
-                # Save the regenerated code to file.
-                self.generate_python_script(PASS_2_PY_FILE_NAME, pass_2_code)
+            # A full rewrite prompt that does not fit the budget is None.
+            rewrite_prompt = self._budget_prompt(self.regenerate_prompt, issues, code=code)
 
-                # Generate the Bandit report for the regenerated code.
-                code_file_path = get_file_path(PASS_2_PY_FILE_NAME)
-                bandit_report_file_path = get_file_path(PASS_2_BANDIT_REPORT_FILE_NAME)
-                self.create_bandit_report(code_file_path, bandit_report_file_path)
+            patched = None
+            if self.targeted_repair or rewrite_prompt is None:
+                # Ask for replacements of the flagged parts, patch them in and analyze the patched code.
+                prompt, response, patched, analysis = await self._request_patch(code, issues, call_llm,
+                                                                                required=rewrite_prompt is None)
+                if prompt is not None:
+                    tokens_used += estimate_tokens(prompt) + estimate_tokens(response)
 
-                # Identify which files should be sent to final output.
-                final_py_file = PASS_2_PY_FILE_NAME
-                final_bandit_report_file = PASS_2_BANDIT_REPORT_FILE_NAME
+            if patched is not None:
+                code, response = patched, None
+            elif rewrite_prompt is None:
+                print("Error: the code is too large to repair within the prompt token budget.")
+                break
             else:
+                # Regenerate the code and analyze the regenerated code.
+                response, code, analysis = await self._request_code(rewrite_prompt, False, call_llm, stream_llm,
+                                                                    "llm_repair")
+                tokens_used += estimate_tokens(rewrite_prompt) + estimate_tokens(response)
+
+            if not code:
                 print("Error: no code was generated by the modified prompt.")
-        else:
-            # If no issues were found, generate only the security report.
-            response2 = self.call_llm(self.report_only_prompt.format(code=pass_1_code))
+                break
+
+            # Save the regenerated code to file.
+            self.generate_python_script(os.path.join(workspace, PASS_PY_FILE_NAME.format(number=round_number)), code)
+            findings, issues, complete = analysis
+            passes.append({"code": code, "findings": findings})
+            issues = filter_issues(issues, self.min_issue_severity, self.min_issue_confidence)
+
+            risk = severity_counts(issues)
+            if risk >= best_risk:
+                # The risk stopped falling, so further rounds are unlikely to help.
+                break
+
+            best_code, best_findings, best_response, best_complete = code, findings, response, complete
+            best_risk = risk
+
+        return best_code, best_findings, best_response, best_complete
+
+    async def _request_patch(self, code, issues, call_llm, required=False):
+        """
+        Asks the LLM for replacements of the parts of the code around the
+        flagged lines, patches them into the code, and analyzes the result.
+        If the prompt does not fit the prompt token budget, the lowest risk
+        issues and then the context around the flagged lines are left out.
+
+        Args:
+          code: The code to repair.
+          issues: The issues to fix, as returned by prioritize_findings.
+          call_llm: A coroutine function with the same arguments as call_llm.
+          required: Indicates if the parts are sent however much of the
+            code they cover, as a full rewrite is not possible (optional).
+        Returns:
+          A tuple of the prompt, the response text, the patched code, and the
+            findings and issues returned by analyze_code. The prompt and
+            response are None if the flagged parts are too large to be
+            worth sending alone or do not fit the budget. The patched code
+            and analysis are None if the replacements could not be applied
+            or the patched code does not compile.
+        """
+        lines = [line for issue in issues for line in issue["lines"]]
+        regions = find_regions(code, lines)
+        region_lines = sum(last_line - first_line + 1 for first_line, last_line in regions)
+        if not regions or (not required and region_lines > len(code.splitlines()) * TARGETED_REPAIR_MAX_FRACTION):
+            return None, None, None, None
+
+        prompt = self._budget_prompt(self.targeted_repair_prompt, issues, parts=format_regions(code, regions))
+        if prompt is None and CONTEXT_LINES:
+            self.token_usage.trim("code_context", 1)
+            regions = find_regions(code, lines, context=0)
+            prompt = self._budget_prompt(self.targeted_repair_prompt, issues, parts=format_regions(code, regions))
+        if prompt is None:
+            return None, None, None, None
+
+        with self._llm_stage("llm_repair", targeted=True) as llm_stage:
+            response = await call_llm(prompt)
+            llm_stage.set(response_chars=len(response), response_tokens=estimate_tokens(response))
+
+        with self._stage("parse", response_chars=len(response)) as parse_stage:
+            patched = apply_replacements(code, regions, *parse_replacements(response))
+            parse_stage.set(code_chars=len(patched or ""))
+
+        if patched is None or find_syntax_error(patched) is not None:
+            # Do not serve the unusable response again.
+            if self.response_cache is not None:
+                self.response_cache.delete(self.response_key(prompt))
+            if not required:
+                print("Note: the targeted repair could not be applied, so the whole code will be rewritten.")
+            return prompt, response, None, None
 
-            # Identify which files should be sent to final output.
-            final_py_file = PASS_1_PY_FILE_NAME
-            final_bandit_report_file = PASS_1_BANDIT_REPORT_FILE_NAME
+        return prompt, response, patched, await run_in_executor(self.analyze_code, patched)
 
-        # Copy the final code and bandit report.
-        shutil.copy(get_file_path(final_py_file), get_file_path(FINAL_PY_FILE_NAME))
-        shutil.copy(get_file_path(final_bandit_report_file), get_file_path(FINAL_BANDIT_REPORT_FILE_NAME))
+    def _budget_prompt(self, template, issues, **fields):
+        """
+        Fills in a prompt template with the issues to fix. If the prompt
+        does not fit the prompt token budget, the lowest risk issues are
+        left out. They are still found by the next scan.
+
+        Args:
+          template: The prompt template, with an issues field.
+          issues: The issues returned by prioritize_findings, highest risk first.
+          fields: The template's other fields.
+        Returns:
+          The prompt, or None if it does not fit the budget even with only
+            the highest risk issue.
+        """
+        issue_prompts = format_issues(issues)
+        if self.prompt_token_budget is None:
+            return template.format(issues=issue_prompts, **fields)
+
+        available = self.prompt_token_budget - self.token_usage.estimate(template.format(issues=[], **fields))
+        kept = fit_to_budget(issue_prompts, available, self.token_usage.estimate)
+        if not kept:
+            return None
+        self.token_usage.trim("issues", len(issue_prompts) - kept)
+        return template.format(issues=issue_prompts[:kept], **fields)
+
+    def _record_usage(self, contents, response_text, response, seconds):
+        """
+        Records the estimated and reported token counts of an LLM call.
 
-        # Save the AI's security report to a file in the output folder.
-        self.save_security_report(response2, get_file_path(LLM_SECURITY_REPORT_FILE_NAME))
+        Args:
+          contents: The contents sent to the model.
+          response_text: The text of the response.
+          response: The response, or its last chunk if it was streamed.
+          seconds: The duration of the call.
+        """
+        attached = not isinstance(contents, str)
+        prompt = " ".join(part for part in contents if isinstance(part, str)) if attached else contents
+        call = self.token_usage.record(estimate_tokens(prompt), estimate_tokens(response_text),
+                                       *usage_tokens(response), calibrate=not attached)
+        if self.instrumentation is not None:
+            self.instrumentation.record("token_usage", seconds, attached=attached, **call)
+
+    def _write_final_output(self, workspace, run_output_dir, final_code, findings, complete, response_text):
+        """
+        Writes the final code, Bandit report and security report into the
+        workspace and publishes the workspace as the run's output directory.
+        Third-party modules the code imports that are not installed are
+        listed in a separate file.
+
+        Args:
+          workspace: The run's workspace directory.
+          run_output_dir: The output directory of the run.
+          final_code: The final generated code.
+          findings: The Bandit findings for the final code.
+          complete: Indicates if every analyzer finished on the final code.
+          response_text: The LLM response holding the security report.
+        """
+        self.generate_python_script(os.path.join(workspace, FINAL_PY_FILE_NAME), final_code)
+        write_bandit_report(findings, os.path.join(workspace, FINAL_BANDIT_REPORT_FILE_NAME))
+        if not complete:
+            print(f"Warning: not every analyzer finished on the final code, so {FINAL_BANDIT_REPORT_FILE_NAME}"
+                  " may be missing issues.")
+        self.save_security_report(response_text, os.path.join(workspace, LLM_SECURITY_REPORT_FILE_NAME))
 
-        print("\nGenerated code, Bandit analysis, and LLM security report are located in the output folder.\n")
+        missing_imports = find_missing_imports(final_code)
+        if missing_imports:
+            with open(os.path.join(workspace, MISSING_IMPORTS_FILE_NAME), "w") as missing_imports_file:
+                missing_imports_file.write("\n".join(missing_imports) + "\n")
+            print(f"Note: the generated code imports modules that are not installed: {', '.join(missing_imports)}")
+
+        publish_directory(workspace, run_output_dir)
+
+    def _stage(self, name, **attributes):
+        """
+        Times a pipeline stage. Its duration is passed to stage_recorder,
+        added to the run's timings for the run store and passed, with its
+        attributes, to the instrumentation. Does nothing if none of them is set.
+
+        Args:
+          name: The name of the stage.
+          attributes: The attributes known when the stage starts (optional).
+        Returns:
+          A context manager yielding a Stage for adding attributes, or
+            NULL_STAGE if nothing records them.
+        """
+        if self.stage_recorder is None and self.instrumentation is None and self.run_store is None:
+            return NULL_STAGE
+        return self._timed_stage(name, attributes)
+
+    @contextlib.contextmanager
+    def _llm_stage(self, name, **attributes):
+        """
+        Times a stage that makes an LLM call. The contents built for the
+        call set its prompt_chars and prompt_tokens attributes, so they
+        measure what is sent, including inlined data set examples. They are
+        not set if the response comes from the cache.
+
+        Args:
+          name: The name of the stage.
+          attributes: The attributes known when the stage starts (optional).
+        Returns:
+          A context manager yielding the stage, like _stage.
+        """
+        with self._stage(name, **attributes) as stage:
+            token = current_llm_stage.set(stage)
+            try:
+                yield stage
+            finally:
+                current_llm_stage.reset(token)
+
+    @contextlib.contextmanager
+    def _timed_stage(self, name, attributes):
+        """
+        Times a stage for _stage when something records it.
+        """
+        start_time = time.perf_counter()
+        try:
+            if self.instrumentation is None:
+                yield NULL_STAGE
+            else:
+                with self.instrumentation.stage(name, **attributes) as stage:
+                    yield stage
+        finally:
+            seconds = time.perf_counter() - start_time
+            if self.stage_recorder is not None:
+                self.stage_recorder(name, seconds)
+            stage_times = current_stage_times.get()
+            if stage_times is not None:
+                stage_times[name] = stage_times.get(name, 0.0) + seconds
+
+    def _record_stage(self, name, seconds, **attributes):
+        """
+        Records a stage that was timed elsewhere, such as an analyzer run
+        by the analyzer pipeline.
+
+        Args:
+          name: The name of the stage.
+          seconds: The duration of the stage.
+          attributes: The attributes of the stage (optional).
+        """
+        if self.stage_recorder is not None:
+            self.stage_recorder(name, seconds)
+        stage_times = current_stage_times.get()
+        if stage_times is not None:
+            stage_times[name] = stage_times.get(name, 0.0) + seconds
+        if self.instrumentation is not None:
+            self.instrumentation.record(name, seconds, **attributes)
+
+    def _record_run(self, run_id, created, prompt, passes, final_code, succeeded, output_dir, report):
+        """
+        Queues a finished run to be written to the run store.
+
+        Args:
+          run_id: The ID of the run.
+          created: The time the run started, as a timestamp.
+          prompt: The prompt issued by the user.
+          passes: The code and findings of each pass.
+          final_code: The code the run kept, or None if it has none.
+          succeeded: Indicates if the run published its output.
+          output_dir: The run's output directory, or None if it has none.
+          report: The security report, or None if there is none.
+        """
+        final_pass = None
+        for pass_number, run_pass in enumerate(passes, start=1):
+            if run_pass["code"] == final_code:
+                final_pass = pass_number
+
+        self.run_store.record_run({
+            "run_id": run_id,
+            "created": created,
+            "model": self.model.name,
+            "prompt": prompt,
+            "succeeded": succeeded,
+            "final_pass": final_pass,
+            "output_dir": output_dir,
+            "report": report,
+            "timings": {name: round(seconds * 1000, 3) for name, seconds in current_stage_times.get().items()},
+            "passes": passes,
+        })
+
+    def generate_batch(self, prompts, output_dir, max_workers=4):
+        """
+        Runs many prompts through generate concurrently. Each prompt is
+        handled on its own worker thread, so LLM calls for some prompts
+        overlap with Bandit scans of others.
+
+        Args:
+          prompts: A list of (prompt ID, prompt) tuples.
+          output_dir: The directory to place the results in. The runs of
+            each prompt go into a sub-directory named after its ID.
+          max_workers: The maximum number of prompts processed at once (optional).
+        Returns:
+          A dictionary mapping each prompt ID to its run's output directory, None
+            if no code was generated, or the exception that stopped it.
+        """
+        def run(prompt_id, prompt):
+            try:
+                return self.generate(prompt, os.path.join(output_dir, prompt_id))
+            except Exception as error:
+                print(f"Error: prompt {prompt_id} failed: {error}")
+                return error
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {prompt_id: executor.submit(run, prompt_id, prompt) for prompt_id, prompt in prompts}
+            return {prompt_id: future.result() for prompt_id, future in futures.items()}
 
     def save_security_report(self, response_text, output_file):
         """
@@ -201,28 +1261,41 @@ class SecureCodeGen():
             output_file: The path to the output file.
         """
 
-        # Extract the security report using the `extract_security_report` function
-        security_report = self.extract_security_report(response_text)
+        with self._stage("save_report", response_chars=len(response_text)) as report_stage:
+            # Extract the security report using the `extract_security_report` function
+            security_report = self.extract_security_report(response_text)
+            report_stage.set(report_chars=len(security_report))
 
-        # Create the output directory if it doesn't exist
-        os.makedirs('output', exist_ok=True)
+            # Create the output directory if it doesn't exist
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
 
-        with open(output_file, "w") as report_file:
-            report_file.write(security_report)
+            with open(output_file, "w") as report_file:
+                report_file.write(security_report)
 
-    def extract_security_report(self, report):
+    def extract_security_report(self, report, required=False):
         """
         Extracts and filters out unnecessary content before the actual security analysis.
 
         Args:
             report: The raw security report text.
+            required: Indicates if the text must contain a section headed
+                "Security report". Used to split a combined code and report
+                response (optional).
 
         Returns:
             The filtered security report text, starting from the actual security analysis.
+            If required is set and no report section is found, None is returned.
         """
         # Remove code blocks, if any.
         cleaned_report = re.sub(r'```python\n(.*?)```', '', report, flags=re.DOTALL).strip()
 
+        if required:
+            # Look for the report heading requested by the code and report prompt.
+            match = re.search(r"^[#*\s]*Security report\b", cleaned_report, re.IGNORECASE | re.MULTILINE)
+            if not match or not cleaned_report[match.end():].strip(" *:#\n"):
+                return None
+            return cleaned_report[match.start():].strip()
+
         # Look for the section where the security analysis starts and remove unwanted introductory text.
         match = re.search(r"(Security analysis|Security report|Analysis of the code security|.*security.*analysis.*)", cleaned_report, re.IGNORECASE)
 
@@ -244,5 +1317,69 @@ def get_file_path(file_name):
     Returns:
       The file path of the given file.
     """
+    if os.path.isabs(file_name):
+        return file_name
+
     dir = os.path.realpath(os.path.dirname(__file__))
-    return f"{dir}/{file_name}"
\ No newline at end of file
+    return f"{dir}/{file_name}"
+
+def severity_counts(issues):
+    """
+    Counts the Bandit findings behind a list of issues by severity, so
+    sets of issues can be compared by how severe they are.
+
+    Args:
+      issues: The issues returned by prioritize_findings.
+    Returns:
+      A tuple of the number of findings of each severity, highest first.
+        Smaller tuples are less severe.
+    """
+    counts = [0] * len(RANKING)
+    for issue in issues:
+        counts[RANKING.index(issue["severity"])] += issue["count"]
+    return tuple(reversed(counts))
+
+def run_in_executor(function, *args, executor=None):
+    """
+    Runs a function in an executor, by default the event loop's. The
+    function runs in a copy of the current context, so the run ID and any
+    tracing spans carry over to it.
+
+    Args:
+      function: The function to run.
+      args: The arguments of the function.
+      executor: The executor to run the function in (optional).
+    Returns:
+      A future for the function's result.
+    """
+    context = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(executor, functools.partial(context.run, function, *args))
+
+def new_run_id():
+    """
+    Creates a unique ID for a generation run. IDs start with the time
+    the run started, so they sort in the order runs were made.
+
+    Returns:
+      The run ID.
+    """
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:12]}"
+
+def publish_directory(source_dir, target_dir):
+    """
+    Atomically moves a directory to its final location, so readers see
+    either the complete directory or nothing.
+
+    Args:
+      source_dir: The directory to publish.
+      target_dir: The final location of the directory. It must not exist.
+    """
+    os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+    try:
+        os.rename(source_dir, target_dir)
+    except OSError:
+        # The directories are on different file systems. Copy next to the
+        # target first, then rename the copy into place.
+        staging_dir = f"{target_dir}.partial"
+        shutil.copytree(source_dir, staging_dir)
+        os.rename(staging_dir, target_dir)
\ No newline at end of file
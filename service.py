@@ -0,0 +1,370 @@
+import collections
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from bandit_analysis.result_analysis import read_findings
+from secure_code_gen import (FINAL_BANDIT_REPORT_FILE_NAME, FINAL_PY_FILE_NAME, LLM_SECURITY_REPORT_FILE_NAME,
+                             MISSING_IMPORTS_FILE_NAME)
+
+# The largest request body accepted, in bytes.
+MAX_REQUEST_BYTES = 1024 * 1024
+
+# The number of seconds clients are asked to wait before retrying when the queue is full.
+RETRY_AFTER_SECONDS = 5
+
+# The Bandit report fields returned with a job's findings.
+FINDING_FIELDS = ["test_id", "test_name", "issue_severity", "issue_confidence", "issue_cwe", "issue_text",
+                  "line_number"]
+
+class QueueFullError(Exception):
+    """
+    Raised when a job is submitted while the service's queue is full.
+    """
+
+class Job():
+    """
+    A generation job submitted to the service.
+
+    Attributes:
+      job_id: The ID of the job.
+      prompt: The prompt to generate code for.
+      status: One of queued, running, succeeded or failed.
+      created: The time the job was submitted, as a timestamp.
+      started: The time a worker started the job, or None.
+      finished: The time the job finished, or None.
+      output_dir: The run's output directory, or None until it succeeds.
+      error: Why the job failed, or None.
+    """
+    def __init__(self, job_id, prompt):
+        """
+        Initializes a queued job.
+
+        Args:
+          job_id: The ID of the job.
+          prompt: The prompt to generate code for.
+        """
+        self.job_id = job_id
+        self.prompt = prompt
+        self.status = "queued"
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.output_dir = None
+        self.error = None
+
+    def to_dict(self, include_result=False):
+        """
+        Describes the job for the API.
+
+        Args:
+          include_result: Indicates if the generated code, findings and
+            security report of a succeeded job are included (optional).
+        Returns:
+          A dictionary that can be serialized as JSON.
+        """
+        job = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "output_dir": self.output_dir,
+            "error": self.error,
+        }
+        if include_result and self.status == "succeeded":
+            job["result"] = read_result(self.output_dir)
+        return job
+
+class SeCoGenService():
+    """
+    Runs generation jobs on a bounded pool of worker threads that share
+    one SecureCodeGen, so the model client, data set upload and analyzers
+    stay warm between jobs. Jobs wait in a bounded queue. When it is
+    full, new jobs are refused instead of piling up.
+
+    Attributes:
+      scg: The SecureCodeGen the jobs run on.
+      output_dir: The directory the jobs' output directories are created in.
+      workers: The number of worker threads.
+      queue_size: The largest number of jobs waiting for a worker.
+      max_finished_jobs: The number of finished jobs remembered. Older
+        ones are forgotten, although their output stays on disk.
+    """
+    def __init__(self, scg, output_dir, workers=4, queue_size=64, max_finished_jobs=1000):
+        """
+        Initializes the service and starts its workers.
+
+        Args:
+          scg: The SecureCodeGen to run the jobs on.
+          output_dir: The directory the jobs' output directories are created in.
+          workers: The number of worker threads (optional).
+          queue_size: The largest number of jobs waiting for a worker (optional).
+          max_finished_jobs: The number of finished jobs remembered (optional).
+        """
+        self.scg = scg
+        self.output_dir = output_dir
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_finished_jobs = max_finished_jobs
+        self.started = time.time()
+
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._finished = collections.deque()
+        self._counts = collections.Counter()
+        self._durations = collections.deque(maxlen=1000)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = [threading.Thread(target=self._work, name=f"secogen-worker-{number}", daemon=True)
+                         for number in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, prompt):
+        """
+        Queues a generation job.
+
+        Args:
+          prompt: The prompt to generate code for.
+        Returns:
+          The queued Job.
+        Raises:
+          QueueFullError: If the queue is full.
+        """
+        job = Job(uuid.uuid4().hex, prompt)
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self._counts["rejected"] += 1
+                raise QueueFullError(f"The queue is full ({self.queue_size} jobs are waiting).")
+            self._jobs[job.job_id] = job
+            self._counts["submitted"] += 1
+        return job
+
+    def get(self, job_id):
+        """
+        Looks up a job.
+
+        Args:
+          job_id: The ID of the job.
+        Returns:
+          The Job, or None if it is unknown or has been forgotten.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def healthy(self):
+        """
+        Returns True if every worker thread is running.
+        """
+        return all(thread.is_alive() for thread in self._threads)
+
+    def metrics(self):
+        """
+        Collects the service's metrics.
+
+        Returns:
+          A dictionary of job counts, queue depth, job durations and the
+            counters of the shared SecureCodeGen and its scheduler.
+        """
+        with self._lock:
+            statuses = collections.Counter(job.status for job in self._jobs.values())
+            durations = sorted(self._durations)
+            counts = dict(self._counts)
+
+        scheduler = self.scg.scheduler
+        return {
+            "uptime_s": time.time() - self.started,
+            "workers": self.workers,
+            "workers_busy": statuses["running"],
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self.queue_size,
+            "jobs_submitted": counts.get("submitted", 0),
+            "jobs_rejected": counts.get("rejected", 0),
+            "jobs_succeeded": counts.get("succeeded", 0),
+            "jobs_failed": counts.get("failed", 0),
+            "job_duration_p50_s": durations[len(durations) // 2] if durations else None,
+            "job_duration_max_s": durations[-1] if durations else None,
+            "analysis_cache_hits": self.scg.analysis_cache_hits,
+            "analysis_cache_misses": self.scg.analysis_cache_misses,
+            "syntax_errors": self.scg.syntax_errors,
+            "llm_calls": scheduler.calls,
+            "llm_retries": scheduler.retries,
+            "llm_rejected": scheduler.rejected,
+            "token_estimate_ratio": self.scg.token_usage.ratio,
+            "prompt_components_trimmed": dict(self.scg.token_usage.trimmed),
+        }
+
+    def stop(self):
+        """
+        Stops the workers once the queued jobs are done.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        """
+        Runs queued jobs until stop is called.
+        """
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+
+            job.status = "running"
+            job.started = time.time()
+            try:
+                job.output_dir = self.scg.generate(job.prompt, os.path.join(self.output_dir, job.job_id))
+                if job.output_dir is None:
+                    job.error = "No usable code was generated. Please retry or modify the prompt."
+            except Exception as error:
+                print(f"Error: job {job.job_id} failed: {error}")
+                job.error = f"{type(error).__name__}: {error}"
+            job.finished = time.time()
+            job.status = "failed" if job.error else "succeeded"
+            self._finish(job)
+
+    def _finish(self, job):
+        """
+        Counts a finished job and forgets the oldest finished jobs.
+        """
+        with self._lock:
+            self._counts[job.status] += 1
+            self._durations.append(job.finished - job.started)
+            self._finished.append(job.job_id)
+            while len(self._finished) > self.max_finished_jobs:
+                self._jobs.pop(self._finished.popleft(), None)
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the SeCoGen JSON API:
+
+      POST /jobs with {"prompt": ...} queues a job and returns its ID.
+      GET /jobs/<job_id> returns a job's status, and its code, findings
+        and security report once it has succeeded.
+      GET /health reports whether the workers are running.
+      GET /metrics returns the service's metrics.
+
+    The service is taken from the server's service attribute.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        """
+        Queues a job.
+        """
+        if self.path.rstrip("/") != "/jobs":
+            return self._send_json(404, {"error": "Not found."})
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        # The body is not read in either case, so the connection cannot be reused.
+        if length < 0:
+            self.close_connection = True
+            return self._send_json(400, {"error": "The Content-Length header must be a non-negative integer."})
+        if length > MAX_REQUEST_BYTES:
+            self.close_connection = True
+            return self._send_json(413, {"error": f"The request is larger than {MAX_REQUEST_BYTES} bytes."})
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send_json(400, {"error": "The request body is not valid JSON."})
+
+        prompt = body.get("prompt") if isinstance(body, dict) else None
+        if not isinstance(prompt, str) or not prompt.strip():
+            return self._send_json(400, {"error": "The request needs a non-empty \"prompt\" string."})
+
+        try:
+            job = self.server.service.submit(prompt)
+        except QueueFullError as error:
+            return self._send_json(503, {"error": str(error)}, {"Retry-After": str(RETRY_AFTER_SECONDS)})
+        self._send_json(202, job.to_dict(), {"Location": f"/jobs/{job.job_id}"})
+
+    def do_GET(self):
+        """
+        Returns a job, the health or the metrics.
+        """
+        service = self.server.service
+        path = self.path.split("?", 1)[0].rstrip("/")
+
+        if path == "/health":
+            healthy = service.healthy()
+            return self._send_json(200 if healthy else 503, {"status": "ok" if healthy else "unhealthy"})
+        if path == "/metrics":
+            return self._send_json(200, service.metrics())
+        if path.startswith("/jobs/"):
+            job = service.get(path[len("/jobs/"):])
+            if job is None:
+                return self._send_json(404, {"error": "Unknown job."})
+            return self._send_json(200, job.to_dict(include_result=True))
+        self._send_json(404, {"error": "Not found."})
+
+    def log_message(self, format, *args):
+        """
+        Keeps request logs out of the generation output.
+        """
+
+    def _send_json(self, status, body, headers=None):
+        """
+        Sends a JSON response.
+        """
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+def read_result(output_dir):
+    """
+    Reads the output of a succeeded run.
+
+    Args:
+      output_dir: The run's output directory.
+    Returns:
+      A dictionary with the final code, its Bandit findings, the security
+        report and any missing imports.
+    """
+    def read(file_name):
+        file_path = os.path.join(output_dir, file_name)
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path) as output_file:
+            return output_file.read()
+
+    findings = [{field: finding.get(field) for field in FINDING_FIELDS}
+                for finding in read_findings(os.path.join(output_dir, FINAL_BANDIT_REPORT_FILE_NAME))]
+    missing_imports = read(MISSING_IMPORTS_FILE_NAME)
+    return {
+        "code": read(FINAL_PY_FILE_NAME),
+        "findings": findings,
+        "security_report": read(LLM_SECURITY_REPORT_FILE_NAME),
+        "missing_imports": missing_imports.split() if missing_imports else [],
+    }
+
+def create_server(service, host="127.0.0.1", port=8000):
+    """
+    Creates an HTTP server for a service. Each request is handled on its
+    own thread, so status requests are answered while jobs run.
+
+    Args:
+      service: The SeCoGenService to serve.
+      host: The address to listen on (optional).
+      port: The port to listen on, or 0 for any free port (optional).
+    Returns:
+      The ThreadingHTTPServer. Call serve_forever to start serving.
+    """
+    server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
@@ -0,0 +1,87 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from llm.data_set_upload import DataSetUploader
+
+class StubUploadAPI():
+    """
+    A local stand-in for the file upload API. Each upload gets a new URI
+    and expires after the given lifetime.
+
+    Attributes:
+      lifetime: How long uploaded files are kept.
+      uploaded: The paths of the uploaded files, in upload order.
+    """
+    def __init__(self, lifetime=timedelta(hours=48)):
+        """
+        Initializes the stub.
+
+        Args:
+          lifetime: How long uploaded files are kept (optional).
+        """
+        self.lifetime = lifetime
+        self.uploaded = []
+
+    def upload_file(self, file_path):
+        """
+        Records the upload and returns a handle like google.generativeai.upload_file.
+        """
+        self.uploaded.append(file_path)
+        return SimpleNamespace(uri=f"https://files.example/{len(self.uploaded)}", mime_type="text/plain",
+                               expiration_time=datetime.now(timezone.utc) + self.lifetime)
+
+def write_data_set(tmp_path, text):
+    data_set_path = tmp_path / "data_set.txt"
+    data_set_path.write_text(text)
+    return str(data_set_path)
+
+def test_repeated_attachments_upload_once(tmp_path):
+    api = StubUploadAPI()
+    uploader = DataSetUploader(str(tmp_path / "state.json"), api.upload_file)
+    data_set_path = write_data_set(tmp_path, "examples")
+
+    attachments = [uploader.attachment(data_set_path) for _ in range(3)]
+
+    assert len(api.uploaded) == 1
+    assert uploader.uploads == 1
+    assert all(attachment == attachments[0] for attachment in attachments)
+    assert attachments[0]["file_data"] == {"file_uri": "https://files.example/1", "mime_type": "text/plain"}
+
+def test_changed_file_is_uploaded_again(tmp_path):
+    api = StubUploadAPI()
+    uploader = DataSetUploader(str(tmp_path / "state.json"), api.upload_file)
+    data_set_path = write_data_set(tmp_path, "examples")
+    first = uploader.attachment(data_set_path)
+
+    write_data_set(tmp_path, "more examples")
+    second = uploader.attachment(data_set_path)
+
+    assert len(api.uploaded) == 2
+    assert second != first
+
+def test_handle_inside_expiry_margin_is_replaced(tmp_path):
+    api = StubUploadAPI(lifetime=timedelta(minutes=30))
+    uploader = DataSetUploader(str(tmp_path / "state.json"), api.upload_file, expiry_margin=60 * 60)
+    data_set_path = write_data_set(tmp_path, "examples")
+
+    uploader.attachment(data_set_path)
+    uploader.attachment(data_set_path)
+
+    assert len(api.uploaded) == 2
+
+def test_second_uploader_reuses_handle_from_state_file(tmp_path):
+    api = StubUploadAPI()
+    state_file = str(tmp_path / "state.json")
+    data_set_path = write_data_set(tmp_path, "examples")
+    first = DataSetUploader(state_file, api.upload_file).attachment(data_set_path)
+
+    second_uploader = DataSetUploader(state_file, api.upload_file)
+    second = second_uploader.attachment(data_set_path)
+
+    assert len(api.uploaded) == 1
+    assert second_uploader.uploads == 0
+    assert second == first
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from llm.response_cache import ResponseCache
+
+def make_request(calls, delay=0.2):
+    async def request():
+        calls.append(None)
+        await asyncio.sleep(delay)
+        return f"response {len(calls)}"
+    return request
+
+def test_follower_takes_over_when_leader_is_cancelled(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    calls = []
+
+    async def run():
+        leader = asyncio.ensure_future(cache.fetch_async("key", make_request(calls)))
+        await asyncio.sleep(0.05)
+        follower = asyncio.ensure_future(cache.fetch_async("key", make_request(calls)))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        return await follower, leader
+
+    response, leader = asyncio.run(run())
+
+    assert leader.cancelled()
+    assert response == "response 2"
+    assert len(calls) == 2
+    assert cache.get("key") == "response 2"
+
+def test_cancelled_follower_does_not_affect_the_others(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    calls = []
+
+    async def run():
+        leader = asyncio.ensure_future(cache.fetch_async("key", make_request(calls)))
+        await asyncio.sleep(0.05)
+        followers = [asyncio.ensure_future(cache.fetch_async("key", make_request(calls))) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        followers[0].cancel()
+        return await asyncio.gather(leader, followers[1]), followers[0]
+
+    responses, cancelled = asyncio.run(run())
+
+    assert cancelled.cancelled()
+    assert responses == ["response 1", "response 1"]
+    assert len(calls) == 1
+    assert cache.coalesced == 2
+
+def test_leader_error_is_passed_to_followers(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+
+    async def failing_request():
+        await asyncio.sleep(0.1)
+        raise ValueError("quota exceeded")
+
+    async def run():
+        leader = asyncio.ensure_future(cache.fetch_async("key", failing_request))
+        await asyncio.sleep(0.02)
+        follower = asyncio.ensure_future(cache.fetch_async("key", failing_request))
+        return await asyncio.gather(leader, follower, return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert [type(result) for result in results] == [ValueError, ValueError]
+    assert cache.get("key") is None
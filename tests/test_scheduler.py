@@ -0,0 +1,132 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from llm.fake_model import FakeAPIError, FakeModel
+from llm.scheduler import CallScheduler, CircuitOpenError, request_options
+
+def make_scheduler(**kwargs):
+    kwargs.setdefault("requests_per_minute", None)
+    kwargs.setdefault("base_delay", 0.01)
+    return CallScheduler(**kwargs)
+
+def generate(model):
+    return lambda timeout: model.generate_content("prompt", request_options=request_options(timeout)).text
+
+def recover_after(model, failures):
+    """
+    Makes the fake model stop failing once it has answered the given number of requests.
+    """
+    def request(timeout):
+        if model.calls >= failures:
+            model.failure_rate = 0.0
+        return generate(model)(timeout)
+    return request
+
+def test_transient_errors_are_retried_with_exponential_backoff(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("llm.scheduler.time.sleep", sleeps.append)
+    # Always back off for the longest allowed delay.
+    monkeypatch.setattr("llm.scheduler.random.uniform", lambda low, high: high)
+    model = FakeModel(failure_rate=1.0, failure_code=503)
+    scheduler = make_scheduler(max_retries=4, base_delay=0.01, max_delay=0.03)
+
+    response = scheduler.call(recover_after(model, 3))
+
+    assert response == model.respond("prompt")
+    assert model.calls == 4
+    assert model.failures == 3
+    assert scheduler.retries == 3
+    assert [delay for delay in sleeps if delay] == [0.01, 0.02, 0.03]
+    assert scheduler.circuit_breaker.state == "closed"
+
+def test_retries_stop_at_max_retries(monkeypatch):
+    monkeypatch.setattr("llm.scheduler.time.sleep", lambda seconds: None)
+    model = FakeModel(failure_rate=1.0, failure_code=429)
+    scheduler = make_scheduler(max_retries=2, failure_threshold=10)
+
+    with pytest.raises(FakeAPIError):
+        scheduler.call(generate(model))
+
+    assert model.calls == 3
+    assert scheduler.retries == 2
+
+def test_non_retryable_errors_are_raised_at_once():
+    model = FakeModel(failure_rate=1.0, failure_code=400)
+    scheduler = make_scheduler(failure_threshold=1)
+
+    with pytest.raises(FakeAPIError) as error:
+        scheduler.call(generate(model))
+
+    assert error.value.code == 400
+    assert model.calls == 1
+    assert scheduler.retries == 0
+    # The API answered, so the circuit stays closed.
+    assert scheduler.circuit_breaker.state == "closed"
+
+def test_deadline_limits_the_call_including_retries():
+    model = FakeModel(latency=0.5)
+    scheduler = make_scheduler(request_timeout=None, deadline=0.2)
+
+    start_time = time.monotonic()
+    with pytest.raises(TimeoutError):
+        scheduler.call(generate(model))
+
+    assert time.monotonic() - start_time < 0.5
+    assert model.calls == 1
+
+def test_circuit_opens_half_opens_and_closes():
+    model = FakeModel(failure_rate=1.0, failure_code=503)
+    scheduler = make_scheduler(max_retries=0, failure_threshold=2, reset_timeout=0.1)
+
+    for _ in range(2):
+        with pytest.raises(FakeAPIError):
+            scheduler.call(generate(model))
+    assert scheduler.circuit_breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        scheduler.call(generate(model))
+    assert model.calls == 2
+    assert scheduler.rejected == 1
+
+    time.sleep(0.15)
+    assert scheduler.circuit_breaker.state == "half-open"
+
+    model.failure_rate = 0.0
+    scheduler.call(generate(model))
+    assert scheduler.circuit_breaker.state == "closed"
+    assert scheduler.circuit_breaker.failures == 0
+
+def test_failed_trial_call_opens_the_circuit_again():
+    model = FakeModel(failure_rate=1.0, failure_code=503)
+    scheduler = make_scheduler(max_retries=0, failure_threshold=1, reset_timeout=0.1)
+
+    with pytest.raises(FakeAPIError):
+        scheduler.call(generate(model))
+    time.sleep(0.15)
+    assert scheduler.circuit_breaker.state == "half-open"
+
+    with pytest.raises(FakeAPIError):
+        scheduler.call(generate(model))
+    assert scheduler.circuit_breaker.state == "open"
+
+def test_async_calls_are_retried():
+    model = FakeModel(failure_rate=1.0, failure_code=500, latency=0.01)
+    scheduler = make_scheduler()
+
+    async def request(timeout):
+        if model.calls >= 2:
+            model.failure_rate = 0.0
+        response = await model.generate_content_async("prompt", request_options=request_options(timeout))
+        return response.text
+
+    response = asyncio.run(scheduler.call_async(request))
+
+    assert response == model.respond("prompt")
+    assert model.calls == 3
+    assert scheduler.retries == 2